@@ -1,4 +1,7 @@
-from typing import Tuple
+import copy
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from typing import List, Tuple
 
 from ._version import __version__
 from .mdrun.analyzer.a_d import A_D
@@ -19,8 +22,9 @@ from .mdrun.simulator.gromacs import GROMACS
 from .mdrun.simulator.namd import NAMD
 from .mdrun.simulator.superSimulator import SuperSimulator
 from .models.settings import MDsettings
-from .utils.logger import generate_logger
+from .utils.logger import add_file_handler, generate_logger
 from .utils.parser import Parser
+from .utils.slots import SlotPool
 
 parser = Parser()
 settings = parser.parse()
@@ -78,12 +82,68 @@ def pacs_md(
             else:
                 LOGGER.info("cv reached threshold!")
             break
+    cycle.wait_background()
+
+
+def run_trial(settings: MDsettings, slots: SlotPool, worker_slots: SlotPool) -> None:
+    add_file_handler(settings.log_file())
+    LOGGER.info(f"trial{settings.trial:03} starts")
+    (simulator, analyzer, exporter) = prepare_md(settings)
+    simulator.slots = slots
+    analyzer.slots = worker_slots
+    exporter.slots = worker_slots
+    try:
+        pacs_md(settings, simulator, analyzer, exporter)
+    finally:
+        # do not leave the other trials without slots if this trial fails
+        slots.release_held()
+        worker_slots.release_held()
+    LOGGER.info(f"trial{settings.trial:03} done")
+
+
+def pacs_md_trials(settings: MDsettings, trials: List[int]) -> None:
+    """
+    run several trials at the same time. the trials share n_parallel replica
+    slots, so that the MD of one trial fills the slots left idle while the
+    other trials analyze and export their cycles. the analysis and export
+    workers of all trials share another n_parallel slots.
+    the log of each trial is written to trialNNN.log in working_dir
+    """
+    slots = SlotPool(settings.n_parallel)
+    worker_slots = SlotPool(settings.n_parallel)
+    running = {}
+    for trial in trials:
+        trial_settings = copy.copy(settings)
+        trial_settings.trial = trial
+        process = mp.Process(
+            target=run_trial, args=(trial_settings, slots, worker_slots)
+        )
+        process.start()
+        running[process.sentinel] = (process, trial_settings)
+
+    failed_trials = []
+    while len(running) > 0:
+        for sentinel in wait(list(running.keys())):
+            process, trial_settings = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                LOGGER.error(f"error occurred at trial{trial_settings.trial:03}")
+                LOGGER.error(f"see {trial_settings.log_file()}")
+                failed_trials.append(trial_settings.trial)
+            process.close()
+
+    if len(failed_trials) > 0:
+        LOGGER.error(f"{len(failed_trials)} trial(s) failed: {failed_trials}")
+        exit(1)
 
 
 def main():
     LOGGER.info("PaCS-MD starts")
-    (simulator, analyzer, exporter) = prepare_md(settings)
-    pacs_md(settings, simulator, analyzer, exporter)
+    if len(settings.trials) > 1:
+        pacs_md_trials(settings, settings.trials)
+    else:
+        (simulator, analyzer, exporter) = prepare_md(settings)
+        pacs_md(settings, simulator, analyzer, exporter)
     LOGGER.info("PaCS-MD done")
 
 
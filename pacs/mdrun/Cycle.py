@@ -1,19 +1,71 @@
-import subprocess
+import multiprocessing as mp
+import shutil
+import time
+from multiprocessing.connection import Connection
 from pathlib import Path
+from typing import Callable, List, Set
 
 # import pacs.utils.genrepresent as genrepresent
 import pacs.utils.rmfile as rmfile
 import pacs.utils.rmmol as rmmol
+import pacs.utils.state as state
 from pacs._version import __version__
 from pacs.mdrun.analyzer.superAnalyzer import SuperAnalyzer
 from pacs.mdrun.exporter.superExporter import SuperExporter
 from pacs.mdrun.simulator.superSimulator import SuperSimulator
 from pacs.models.settings import MDsettings
-from pacs.utils.logger import close_logger, generate_logger
+from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
 
 
+class ExportGate:
+    """
+    tells which replicas of the next cycle already have their input structure
+    while the previous cycle is exported and cleaned up in the background
+
+    @param
+    process:mp.Process background process exporting the previous cycle
+    conn:Connection receives the replica number every time an input is written
+    """
+
+    def __init__(self, process: mp.Process, conn: Connection) -> None:
+        self.process = process
+        self.conn = conn
+        self.ready: Set[int] = set()
+        self.closed = False
+
+    def waitables(self) -> List[Connection]:
+        return [] if self.closed else [self.conn]
+
+    def update(self, block: bool = False) -> None:
+        while not self.closed and self.conn.poll(None if block else 0):
+            block = False
+            try:
+                self.ready.add(self.conn.recv())
+            except EOFError:
+                # the background process has finished
+                self.closed = True
+                self.conn.close()
+                self.process.join()
+                if self.process.exitcode != 0:
+                    LOGGER.error("error occurred at export of the previous cycle")
+                    exit(1)
+                self.process.close()
+
+    def is_ready(self, replica: int) -> bool:
+        if replica in self.ready:
+            return True
+        if self.closed:
+            LOGGER.error(f"input structure of replica{replica:03} was not exported")
+            exit(1)
+        return False
+
+    def join(self) -> None:
+        while not self.closed:
+            self.update(block=True)
+
+
 class Cycle:
     """
     class for running a cycle of pacsmd
@@ -36,6 +88,7 @@ class Cycle:
         self.simulator = simulator
         self.analyzer = analyzer
         self.exporter = exporter
+        self.gate: ExportGate = None
 
     def run(self) -> None:
         if not self.is_needed():
@@ -48,6 +101,7 @@ class Cycle:
             self.calculate_cv()
 
     def is_finished(self) -> bool:
+        self.wait_background()
         if not self.is_needed():
             return False
         if self.meet_threshold():
@@ -58,13 +112,36 @@ class Cycle:
             return True
         else:
             self.prepare_next_cycle()
-            self.export()
-            if self.settings.rmmol:
-                self.rmmol(last_cycle=False)
-            if self.settings.rmfile:
-                self.clean_cycle()
+            if self.settings.pipeline:
+                # the MD of the next cycle starts replica by replica
+                # as soon as each input structure has been exported
+                recv_conn, send_conn = mp.Pipe(duplex=False)
+                process = mp.Process(target=self.export_and_clean, args=(send_conn,))
+                process.start()
+                send_conn.close()
+                self.gate = ExportGate(process, recv_conn)
+            else:
+                self.export_and_clean()
             return False
 
+    def export_and_clean(self, conn: Connection = None) -> None:
+        if conn is None:
+            self.export()
+        else:
+            self.export(on_exported=conn.send)
+        if self.settings.rmmol:
+            self.rmmol(last_cycle=False)
+        if self.settings.rmfile:
+            self.clean_cycle()
+
+    def wait_background(self) -> None:
+        """
+        wait until the export and cleanup of the previous cycle have finished
+        """
+        if self.gate is not None:
+            self.gate.join()
+            self.gate = None
+
     def prepare_trial(self) -> None:
         """
         this is a method for preparing the trial, cycle 0
@@ -72,14 +149,16 @@ class Cycle:
         self.prepare_next_cycle(cycle=-1, replica=1)
         extension = Path(self.settings.structure).suffix
         dir = self.settings.each_replica(_cycle=0, _replica=1)
-        cmd_cp = f"cp {self.settings.structure} {dir}/input{extension}"
-        res_cp = subprocess.run(cmd_cp, shell=True)
-        if res_cp.returncode != 0:
+        try:
+            shutil.copyfile(self.settings.structure, f"{dir}/input{extension}")
+        except OSError:
             LOGGER.error("error occurred at cp command")
             LOGGER.error(f"check the authority of {dir}/")
             exit(1)
         tmp = self.settings.n_replica
         self.settings.n_replica = 1
+        # the top n_replica snapshots of cycle 0 are the inputs of cycle 1
+        self.analyzer.n_ranked = tmp
         # create version file of pacstk
         version_file = f"{self.settings.each_trial()}/pacstk.version"
         if Path(version_file).exists():
@@ -98,6 +177,7 @@ class Cycle:
         self.run_md()
         self.calculate_cv()
         self.settings.n_replica = tmp
+        self.analyzer.n_ranked = None
         # If rmmol is True, create a topology file with keep_selection only
         if self.settings.rmmol:
             rmmol.make_top(self.settings)
@@ -113,30 +193,36 @@ class Cycle:
                 path.mkdir(parents=True)
 
         next_cycle_dir = Path(f"{self.settings.each_cycle(_cycle=cycle + 1)}")
-        make_dir(next_cycle_dir / "summary")
-        for rep in range(1, replica + 1):
-            make_dir(next_cycle_dir / f"replica{rep:03}")
-
-        cmd_touch = f"touch {next_cycle_dir}/summary/progress.log"
-        res_touch = subprocess.run(cmd_touch, shell=True)
-        if res_touch.returncode != 0:
-            LOGGER.error("error occurred at touch command")
-            LOGGER.error(f"check authority of {next_cycle_dir}/summary/")
+        try:
+            make_dir(next_cycle_dir / "summary")
+            for rep in range(1, replica + 1):
+                make_dir(next_cycle_dir / f"replica{rep:03}")
+        except OSError:
+            LOGGER.error("error occurred at mkdir command")
+            LOGGER.error(f"check authority of {next_cycle_dir.parent}/")
             exit(1)
 
     def run_md(self) -> None:
-        self.simulator.run_parallel(self.settings, self.cycle)
+        if self.settings.pipeline:
+            # start the CV calculation of each replica as soon as its MD finishes
+            def on_finished(replica: int) -> None:
+                self.analyzer.submit(self.settings, self.cycle, replica)
+
+            self.simulator.run_parallel(
+                self.settings, self.cycle, on_finished, self.gate
+            )
+        else:
+            self.simulator.run_parallel(self.settings, self.cycle)
         # self.simulator.run_serial(self.settings, self.cycle)
 
     def calculate_cv(self) -> None:
         self.results = self.analyzer.analyze(self.settings, self.cycle)
 
-    def export(self) -> None:
-        self.exporter.export(self.settings, self.cycle)
-        dir = self.settings.each_cycle(_cycle=self.cycle)
-        logger = generate_logger(f"{self.cycle}", f"{dir}/summary/progress.log")
-        logger.info(f"export to cycle{self.cycle + 1:03} is completed")
-        close_logger(logger)
+    def export(self, on_exported: Callable[[int], None] = None) -> None:
+        started = time.time()
+        self.exporter.export(self.settings, self.cycle, on_exported)
+        state.record(self.settings, self.cycle, "export", started=started)
+        LOGGER.info(f"export to cycle{self.cycle + 1:03} is completed")
 
     def rmmol(self, last_cycle: bool) -> None:
         rmmol.rmmol(self.settings, self.cycle, last_cycle)
@@ -145,22 +231,13 @@ class Cycle:
         rmfile.rmfile(self.settings, self.cycle)
 
     def is_needed(self) -> bool:
-        fn = f"{self.settings.each_cycle(_cycle=self.cycle)}/summary/progress.log"
-        if not Path(fn).exists():
-            return True
-
-        export_needed: bool = True
-        rmmol_needed: bool = self.settings.rmmol
-        rmfile_needed: bool = self.settings.rmfile
-
-        with open(fn, "r") as f:
-            for line in f:
-                if "export to" in line:
-                    export_needed = False
-                if "reduced" in line:
-                    rmmol_needed = False
-                if "rmfile" in line:
-                    rmfile_needed = False
+        export_needed: bool = not state.is_recorded(self.settings, self.cycle, "export")
+        rmmol_needed: bool = self.settings.rmmol and not state.is_recorded(
+            self.settings, self.cycle, "rmmol"
+        )
+        rmfile_needed: bool = self.settings.rmfile and not state.is_recorded(
+            self.settings, self.cycle, "rmfile"
+        )
 
         return any([export_needed, rmmol_needed, rmfile_needed])
 
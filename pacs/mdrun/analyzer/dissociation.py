@@ -5,18 +5,21 @@ https://doi.org/10.1021/acs.jctc.7b00504
 """
 
 import multiprocessing as mp
-import subprocess
 from typing import List
 
 import numpy as np
-from pacs.mdrun.analyzer.superAnalyzer import SuperAnalyzer
-from pacs.models.settings import MDsettings, Snapshot
+from pacs.mdrun.analyzer.superAnalyzer import GMX_CV_GROUP, SuperAnalyzer
+from pacs.models.settings import MDsettings, Snapshot, Snapshots
+from pacs.utils.com import com_distance
+from pacs.utils.engine import Command, remove_files
 from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
 
 
 class Dissociation(SuperAnalyzer):
+    cpptraj_output = "interCOM.xvg"
+
     def calculate_cv(
         # self, settings: MDsettings, cycle: int, replica: int, send_rev
         self,
@@ -37,8 +40,8 @@ class Dissociation(SuperAnalyzer):
         queue.put(ret)
         return ret
 
-    def ranking(self, settings: MDsettings, CVs: List[Snapshot]) -> List[Snapshot]:
-        sorted_cv = sorted(CVs, key=lambda x: x.cv, reverse=True)
+    def ranking(self, settings: MDsettings, CVs: Snapshots) -> Snapshots:
+        sorted_cv = CVs.top(self.n_top(settings), reverse=True)
         return sorted_cv
 
     def is_threshold(self, settings: MDsettings, CVs: List[Snapshot] = None) -> bool:
@@ -52,106 +55,64 @@ class Dissociation(SuperAnalyzer):
         cycle: int,
         replica: int,
     ) -> List[float]:
-        import mdtraj as md
-
-        dir = settings.each_replica(_cycle=cycle, _replica=replica)
-        trj = md.load(
-            f"{dir}/prd{settings.trajectory_extension}",
-            top=settings.top_mdtraj,
-        )
-
-        com1 = md.compute_center_of_mass(
-            trj.atom_slice(trj.topology.select(settings.selection1))
-        )
-        com2 = md.compute_center_of_mass(
-            trj.atom_slice(trj.topology.select(settings.selection2))
-        )
-        dist = np.array([np.linalg.norm(com1[i] - com2[i]) for i in range(len(com1))])
-        return dist
+        dist = [
+            com_distance(trj, index1, index2)
+            for trj, (index1, index2) in self.iter_trajectory(
+                settings, cycle, replica, [settings.selection1, settings.selection2]
+            )
+        ]
+        return np.concatenate(dist)
 
-    def cal_by_gmx(
-        self,
-        settings: MDsettings,
-        cycle: int,
-        replica: int,
-    ) -> List[float]:
+    def gmx_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
         extension = settings.trajectory_extension
         grp1 = settings.selection1
         grp2 = settings.selection2
 
         dir = settings.each_replica(_cycle=cycle, _replica=replica)
-
-        # nojump treatment
-        if settings.nojump is True:
-            pbc_option = "-pbc nojump"
-        else:
-            pbc_option = "-pbc mol -ur compact"
-
-        cmd_image = f"echo 'System' \
-                | {settings.cmd_gmx} trjconv \
-                -f {dir}/prd{extension} \
-                -s {dir}/prd.tpr \
-                -o {dir}/prd_image{extension} \
-                {pbc_option} \
-                1> {dir}/image.log 2>&1"  # NOQA: E221
-
-        res_image = subprocess.run(cmd_image, shell=True)
-        if res_image.returncode != 0:
-            LOGGER.error("error occured at image command")
-            LOGGER.error(f"see {dir}/image.log")
-            exit(1)
+        # prd_image holds only the atoms of the groups, given by -fgroup
+        index, _, _ = self.gmx_index(settings, [grp1, grp2])
 
         cmd_dist = f"{settings.cmd_gmx} distance \
                 -f {dir}/prd_image{extension} \
                 -s {dir}/prd.tpr \
-                -n {settings.index_file} \
+                -n {index} \
+                -fgroup 'group {GMX_CV_GROUP}' \
                 -oxyz {dir}/interCOM_xyz.xvg \
                 -xvg none \
                 -pbc no \
-                -select 'com of group {grp2} plus com of group {grp1}' \
-                1> {dir}/distance.log 2>&1"  # NOQA: E221
-
-        res_dist = subprocess.run(cmd_dist, shell=True)
-        if res_dist.returncode != 0:
-            LOGGER.error("error occurred at distance command")
-            LOGGER.error(f"see {dir}/distance.log")
-            exit(1)
-
-        cmd_rmfile = f"rm {dir}/prd_image{extension}"
-        subprocess.run(cmd_rmfile, shell=True)
+                -select 'com of group {grp2} plus com of group {grp1}'"  # NOQA: E221
+        return [
+            self.gmx_image_command(settings, dir, [grp1, grp2]),
+            Command(
+                cmd=cmd_dist,
+                log=f"{dir}/distance.log",
+                timeout=settings.command_timeout or None,
+                errors=[
+                    "error occurred at distance command",
+                    f"see {dir}/distance.log",
+                ],
+            ),
+            Command(func=remove_files(f"{dir}/prd_image{extension}"), check=False),
+        ]
 
+    def read_gmx(self, settings: MDsettings, cycle: int, replica: int) -> np.ndarray:
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
         xyz_rep = np.loadtxt(f"{dir}/interCOM_xyz.xvg", dtype="float32")
         dist = np.linalg.norm(xyz_rep[:, [1, 2, 3]], axis=1)
         return dist
 
-    def cal_by_cpptraj(
-        self, settings: MDsettings, cycle: int, replica: int
-    ) -> List[float]:
-        dir = settings.each_replica(_cycle=cycle, _replica=replica)
-
-        # Construct the cpptraj command
-        cmd_cpptraj = [
-            f"parm {settings.topology}",
-            f"trajin {dir}/prd{settings.trajectory_extension}",
+    def cpptraj_actions(self, settings: MDsettings, out: str) -> List[str]:
+        return [
             f"center {settings.centering_selection}",
             "image",
-            f"distance {settings.selection1} {settings.selection2} out {dir}/interCOM.xvg",
-            "run",
-            "quit",
+            f"distance {settings.selection1} {settings.selection2} out {out}",
         ]
-        with open(f"{dir}/calCV.cpptraj", "w") as f:
-            f.write("\n".join(cmd_cpptraj))
-
-        res_cpptraj = subprocess.run(
-            f"cpptraj -i {dir}/calCV.cpptraj 1> {dir}/distance.log \
-                    2>&1 --log {dir}/distance.log",
-            shell=True,
-        )
 
-        if res_cpptraj.returncode != 0:
-            LOGGER.error("Error occurred at cpptraj command")
-            LOGGER.error(f"See {dir}/distance.log for details")
-            exit(1)
-
-        dists = np.loadtxt(f"{dir}/interCOM.xvg", dtype="float32")[:, 1]
+    def read_cpptraj(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> np.ndarray:
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        dists = np.loadtxt(f"{dir}/{self.cpptraj_output}", dtype="float32")[:, 1]
         return dists
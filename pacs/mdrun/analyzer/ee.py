@@ -7,27 +7,31 @@ https://doi.org/10.1063/5.0004654
 
 
 import multiprocessing as mp
+import os
 import pickle
-from typing import List
+from pathlib import Path
+from typing import Dict, List
 
 import numpy as np
 from pacs.mdrun.analyzer.superAnalyzer import SuperAnalyzer
-from pacs.models.settings import MDsettings, Snapshot
+from pacs.models.settings import MDsettings, Snapshot, Snapshots
+from pacs.utils.engine import Command, get_engine, remove_files
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_reference, select
 
 LOGGER = generate_logger(__name__)
 
+N_COMPONENTS = 4
+
 
 class EdgeExpansion(SuperAnalyzer):
+    # mean, components and superposition reference of the PCA space of the trial,
+    # loaded by the parent so that the analysis workers inherit it
+    pca_model: Dict[str, np.ndarray] = None
+
     def calculate_cv(
         self, settings: MDsettings, cycle: int, replica: int, queue: mp.Queue
     ) -> List[float]:
-        if settings.reference is None:
-            settings.reference = f"{settings.each_replica(_cycle=0, _replica=1)}/prd{settings.trajectory_extension}"  # NOQA: B950
-
-        if cycle == 0:
-            self.pca(settings, cycle, replica)
-
         if settings.analyzer == "mdtraj":
             ret = self.cal_by_mdtraj(settings, cycle, replica)
         elif settings.analyzer == "gromacs":
@@ -39,90 +43,308 @@ class EdgeExpansion(SuperAnalyzer):
         queue.put(ret)
         return ret
 
-    def ranking(self, settings: MDsettings, CVs: List[Snapshot]) -> List[Snapshot]:
+    def ranking(self, settings: MDsettings, CVs: Snapshots) -> Snapshots:
+        """
+        rank the snapshots by peeling the convex hulls of their CVs (PCA space).
+        the hulls are taken over the rows of CVs which have not been ranked yet,
+        so that each vertex is its snapshot, and no more layers are peeled once
+        n_top snapshots have been ranked. the vertices of a layer are shuffled
+        by a generator seeded with the trial and cycle numbers
+        """
         from scipy.spatial import ConvexHull
 
-        points = []
-        for cv in CVs:
-            points.append(cv.cv)
-        points = np.array(points)
-
-        sorted_cv = []
-        while len(points) > 10:
-            hull = ConvexHull(points)
-            vertices = hull.vertices
-            np.random.shuffle(vertices)
-            for v in vertices:
-                for snapshot in CVs:
-                    if np.allclose(snapshot.cv, points[v]):
-                        sorted_cv.append(snapshot)
-                        break
-            points = np.delete(points, hull.vertices, axis=0)
-        for p in points:
-            for snapshot in CVs:
-                if np.allclose(snapshot.cv, p):
-                    sorted_cv.append(snapshot)
-                    break
-        return sorted_cv
+        points = np.asarray(CVs.cv, dtype=np.float64)
+        n_top = self.n_top(settings)
+        cycle = 0 if self.ranked_cycle is None else self.ranked_cycle
+        rng = np.random.default_rng([settings.trial, cycle])
+        remaining = np.arange(len(CVs))
+        layers = []
+        n_ranked = 0
+        while n_ranked < n_top and len(remaining) > 10:
+            vertices = rng.permutation(ConvexHull(points[remaining]).vertices)
+            layers.append(remaining[vertices])
+            n_ranked += len(vertices)
+            keep = np.ones(len(remaining), dtype=bool)
+            keep[vertices] = False
+            remaining = remaining[keep]
+        # the last few points are ranked in their order
+        layers.append(remaining)
+        return CVs[np.concatenate(layers)[:n_top]]
 
     def is_threshold(self, settings: MDsettings, CVs: List[Snapshot] = None) -> bool:
         # Terminate PaCS-MD only when max_cycle is reached, independent of CV value
         return False
 
-    def pca(self, settings: MDsettings, cycle: int, replica: int):
+    def dispatch(self, settings: MDsettings, cycle: int, block: bool) -> None:
+        if self.pca_model is None and len(self.pending) > 0:
+            self.pca_model = self.load_pca(settings)
+        super().dispatch(settings, cycle, block)
+
+    def pca_file(self, settings: MDsettings) -> Path:
+        return Path(f"{settings.each_replica(_cycle=0, _replica=1)}/pca.npz")
+
+    def load_pca(self, settings: MDsettings) -> Dict[str, np.ndarray]:
+        """
+        PCA space of the trial, which is fitted when it is needed for the first time
+        """
+        path = self.pca_file(settings)
+        if not path.exists():
+            self.fit_pca(settings, path)
+        with np.load(path) as npz:
+            return dict(npz)
+
+    def reference(self, settings: MDsettings) -> str:
+        """
+        trajectory whose frames define the PCA space, cycle 0 if not set
+        """
+        if settings.reference is not None:
+            return settings.reference
+        dir_0_1 = settings.each_replica(_cycle=0, _replica=1)
+        return f"{dir_0_1}/prd{settings.trajectory_extension}"
+
+    def fit_pca(self, settings: MDsettings, path: Path) -> None:
+        """
+        fit the PCA of the selection4 atoms of the frames of reference
+        superposed by the selection3 atoms, and store
+        mean:(3 * n_atoms,) mean of the coordinates
+        components:(N_COMPONENTS, 3 * n_atoms) principal axes
+        reference:(n_fit_atoms, 3) selection3 atoms of the first frame (mdtraj)
+        """
+        arrays: Dict[str, np.ndarray] = {}
+        if settings.analyzer == "mdtraj":
+            xyz, arrays["reference"] = self.reference_by_mdtraj(settings)
+        elif settings.analyzer == "gromacs":
+            xyz = self.reference_by_gmx(settings)
+        elif settings.analyzer == "cpptraj":
+            xyz = self.reference_by_cpptraj(settings)
+        else:
+            raise NotImplementedError
+        legacy = path.with_name("pca.pkl")
+        if legacy.exists():
+            # fitted by an older version, keep its space when the trial is resumed
+            with open(legacy, "rb") as f:
+                pca = pickle.load(f)
+            arrays["mean"], arrays["components"] = pca.mean_, pca.components_
+        else:
+            xyz = xyz.reshape(len(xyz), -1)
+            mean = xyz.mean(axis=0, dtype=np.float64)
+            # the principal axes are the right singular vectors of the centered data
+            _, _, vt = np.linalg.svd(xyz - mean, full_matrices=False)
+            arrays["mean"], arrays["components"] = mean, vt[:N_COMPONENTS]
+        tmp = path.with_name(f"pca.{os.getpid()}.tmp.npz")
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+        LOGGER.info(f"PCA space of the trial was written to {path}")
+
+    def project(self, settings: MDsettings, xyz: np.ndarray) -> np.ndarray:
+        """
+        fitted coordinates of the PCA atoms (n_frames, n_atoms, 3) -> PCs
+        """
+        model = self.pca_model
+        if model is None:
+            model = self.load_pca(settings)
+        xyz = xyz.reshape(len(xyz), -1)
+        return (xyz - model["mean"]) @ model["components"].T
+
+    def read_coordinates(self, trj_file: str) -> np.ndarray:
+        """
+        coordinates (nm) of a trajectory of the selected atoms written by
+        gmx or cpptraj, which is read without a topology and then removed
+        """
         import mdtraj as md
-        from sklearn.decomposition import PCA
 
-        ref_trj = md.load(settings.reference, top=settings.top_mdtraj)
+        with md.open(trj_file) as f:
+            xyz = f.read()[0]
+            if f.distance_unit == "angstroms":
+                xyz = xyz / 10
+        os.remove(trj_file)
+        return xyz
+
+    def reference_by_mdtraj(self, settings: MDsettings):
+        cache_dir = settings.cache_dir()
+        ref_trj = load_reference(
+            self.reference(settings), settings.top_mdtraj, cache_dir
+        )
+        fit_index = select(settings.top_mdtraj, settings.selection3, cache_dir)
         ref_trj.superpose(
             ref_trj,
             0,
-            atom_indices=ref_trj.top.select(settings.selection3),
-            ref_atom_indices=ref_trj.top.select(settings.selection3),
-        )
-        ref_trj_selected = ref_trj.atom_slice(ref_trj.top.select(settings.selection4))
-        pca = PCA(n_components=4)
-        pca.fit(
-            ref_trj_selected.xyz.reshape(
-                ref_trj_selected.n_frames, ref_trj_selected.n_atoms * 3
-            )
-        )
-        pickle.dump(
-            pca, open(f"{settings.each_replica(_cycle=0, _replica=1)}/pca.pkl", "wb")
+            atom_indices=fit_index,
+            ref_atom_indices=fit_index,
         )
+        pca_index = select(settings.top_mdtraj, settings.selection4, cache_dir)
+        return ref_trj.xyz[:, pca_index], ref_trj.xyz[0, fit_index]
 
     def cal_by_mdtraj(
         self, settings: MDsettings, cycle: int, replica: int
     ) -> List[float]:
         import mdtraj as md
 
-        ref = md.load(settings.reference, top=settings.top_mdtraj)
-        dir = settings.each_replica(_cycle=cycle, _replica=replica)
-        trj = md.load(
-            f"{dir}/prd{settings.trajectory_extension}",
-            top=settings.top_mdtraj,
+        model = self.pca_model
+        if model is None:
+            model = self.load_pca(settings)
+        # only the coordinates of the fitted atoms are needed for superposition
+        ref = md.Trajectory(model["reference"][np.newaxis], None)
+        # the reference holds only the selection3 atoms
+        ref_index = np.arange(ref.n_atoms)
+
+        pca_coor = []
+        for trj, (fit_index, pca_index) in self.iter_trajectory(
+            settings, cycle, replica, [settings.selection1, settings.selection2]
+        ):
+            if len(fit_index) != len(ref_index):
+                LOGGER.error(
+                    f"selection1 has {len(fit_index)} atoms, but the reference of "
+                    f"the PCA space (selection3) has {len(ref_index)} atoms"
+                )
+                exit(1)
+            trj.superpose(ref, 0, atom_indices=fit_index, ref_atom_indices=ref_index)
+            pca_coor.append(self.project(settings, trj.xyz[:, pca_index]))
+        return np.concatenate(pca_coor)
+
+    def gmx_fit_command(
+        self,
+        settings: MDsettings,
+        trj_file: str,
+        structure: str,
+        index: str,
+        out_file: str,
+        groups: str,
+    ) -> Command:
+        """
+        write the output group of trj_file fitted (rot+trans) by the fit group
+        on structure
+        """
+        out_dir = Path(out_file).parent
+        cmd_fit = f"{settings.cmd_gmx} trjconv \
+                -f {trj_file} \
+                -s {structure} \
+                -n {index} \
+                -o {out_file} \
+                -fit rot+trans"  # NOQA: E221
+        return Command(
+            cmd=cmd_fit,
+            stdin=groups,
+            log=f"{out_dir}/fit.log",
+            timeout=settings.command_timeout or None,
+            errors=["error occurred at fit command", f"see {out_dir}/fit.log"],
         )
-        trj.superpose(
-            ref,
-            0,
-            atom_indices=trj.top.select(settings.selection1),
-            ref_atom_indices=ref.top.select(settings.selection3),
+
+    def reference_by_gmx(self, settings: MDsettings) -> np.ndarray:
+        # fitted on the initial structure of the trial
+        dir_0_1 = settings.each_replica(_cycle=0, _replica=1)
+        out_file = f"{dir_0_1}/pca_reference{settings.trajectory_extension}"
+        command = self.gmx_fit_command(
+            settings,
+            self.reference(settings),
+            f"{dir_0_1}/prd.tpr",
+            settings.index_file,
+            out_file,
+            f"{settings.selection3}\n{settings.selection4}\n",
         )
+        if get_engine(settings).run([command]) != 0:
+            exit(1)
+        return self.read_coordinates(out_file)
 
-        trj_selected = trj.atom_slice(trj.top.select(settings.selection2))
+    def gmx_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
+        # -pbc and -fit are not given to one trjconv.
+        # prd_image holds only the atoms of the groups, so the initial structure
+        # and the index groups are reduced to the same atoms
+        extension = settings.trajectory_extension
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        groups = [settings.selection1, settings.selection2]
+        _, index, (selection1, selection2) = self.gmx_index(settings, groups)
+        structure = f"{dir}/initial_subset.gro"
+        return [
+            self.gmx_image_command(settings, dir, groups),
+            self.gmx_subset_command(
+                settings,
+                f"{settings.each_replica(_cycle=0, _replica=1)}/prd.tpr",
+                groups,
+                structure,
+            ),
+            self.gmx_fit_command(
+                settings,
+                f"{dir}/prd_image{extension}",
+                structure,
+                index,
+                f"{dir}/pca_input{extension}",
+                f"{selection1}\n{selection2}\n",
+            ),
+            Command(
+                func=remove_files(f"{dir}/prd_image{extension}", structure),
+                check=False,
+            ),
+        ]
+
+    def read_gmx(self, settings: MDsettings, cycle: int, replica: int) -> np.ndarray:
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        xyz = self.read_coordinates(f"{dir}/pca_input{settings.trajectory_extension}")
+        return self.project(settings, xyz)
 
-        PCAspace = pickle.load(
-            open(f"{settings.each_replica(_cycle=0, _replica=1)}/pca.pkl", "rb")
+    def cpptraj_fit_command(
+        self, settings: MDsettings, lines: List[str], dir: str, name: str
+    ) -> Command:
+        """
+        run the cpptraj script of lines, which writes the fitted atoms to name.dcd
+        """
+        with open(f"{dir}/{name}.cpptraj", "w") as f:
+            f.write("\n".join(lines))
+        cmd_cpptraj = f"{settings.cmd_cpptraj} \
+                -i {dir}/{name}.cpptraj \
+                --log {dir}/{name}.log"  # NOQA: E221
+        return Command(
+            cmd=cmd_cpptraj,
+            log=f"{dir}/{name}.log",
+            timeout=settings.command_timeout or None,
+            errors=[
+                "error occurred at cpptraj command",
+                f"see {dir}/{name}.log for details",
+            ],
         )
-        pca_coor = PCAspace.transform(
-            trj_selected.xyz.reshape(trj_selected.n_frames, trj_selected.n_atoms * 3)
+
+    def reference_by_cpptraj(self, settings: MDsettings) -> np.ndarray:
+        dir_0_1 = settings.each_replica(_cycle=0, _replica=1)
+        reference = self.reference(settings)
+        cmd_cpptraj = [
+            f"parm {settings.topology}",
+            f"trajin {reference}",
+            f"reference {reference} [refstr]",
+            f"rms fit ref [refstr] {settings.selection3}",
+            f"strip !({settings.selection4})",
+            f"trajout {dir_0_1}/pca_reference.dcd dcd",
+            "run",
+            "quit",
+        ]
+        command = self.cpptraj_fit_command(
+            settings, cmd_cpptraj, dir_0_1, "pca_reference"
         )
-        return pca_coor
+        if get_engine(settings).run([command]) != 0:
+            exit(1)
+        return self.read_coordinates(f"{dir_0_1}/pca_reference.dcd")
 
-    def cal_by_gmx(self, settings: MDsettings, cycle: int, replica: int) -> List[float]:
-        raise NotImplementedError
+    def cpptraj_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        cmd_cpptraj = [
+            f"parm {settings.topology}",
+            self.cpptraj_trajin(settings, dir),
+            f"center {settings.centering_selection}",
+            "image",
+            f"reference {self.reference(settings)} [refstr]",
+            f"rms fit ref [refstr] {settings.selection1}",
+            f"strip !({settings.selection2})",
+            f"trajout {dir}/pca_input.dcd dcd",
+            "run",
+            "quit",
+        ]
+        return [self.cpptraj_fit_command(settings, cmd_cpptraj, dir, "calCV")]
 
-    def cal_by_cpptraj(
+    def read_cpptraj(
         self, settings: MDsettings, cycle: int, replica: int
-    ) -> List[float]:
-        raise NotImplementedError
+    ) -> np.ndarray:
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        return self.project(settings, self.read_coordinates(f"{dir}/pca_input.dcd"))
@@ -1,131 +1,710 @@
 import dataclasses
 import multiprocessing as mp
-import re
+import os
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from multiprocessing.connection import Connection, wait
 from pathlib import Path
-from typing import List
+from typing import Deque, Dict, Iterator, List, Tuple, Union
 
 import numpy as np
-from pacs.models.settings import MDsettings, Snapshot
+import pacs.utils.cvstore as cvstore
+import pacs.utils.state as state
+from pacs.models.settings import MDsettings, Snapshot, Snapshots
+from pacs.utils.engine import Command, Job, get_engine
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import (
+    index_subset,
+    iterload_selections,
+    load_selections,
+    selected_atoms,
+)
+from pacs.utils.slots import SlotPool
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # python 3.7: the CVs are pickled through the pipe instead
+    resource_tracker = shared_memory = None
 
 LOGGER = generate_logger(__name__)
 np.set_printoptions(suppress=True)
 
+# xyz (float32) of a frame and the temporary copies made by the CV calculation
+FRAME_BYTES_PER_ATOM = 3 * 4 * 3
+# fewer workers are run rather than reading fewer frames at once
+MIN_CHUNK_FRAMES = 100
+# index group of the atoms written to prd_image by the gmx backend
+GMX_CV_GROUP = "PaCS_CV"
+
+
+class _Sender:
+    """
+    adapter which lets calculate_cv return its result by queue.put(ret)
+    or send_rev.send(ret) through the pipe of its own replica.
+    the CVs are written to the shared memory block named by the parent and
+    only their shape and dtype are sent, so that the array is not pickled.
+    without shared memory (python 3.7), the array itself is sent
+    """
+
+    def __init__(self, conn: Connection, name: str) -> None:
+        self.conn = conn
+        self.name = name
+
+    def put(self, obj) -> None:
+        cv = np.ascontiguousarray(obj)
+        if shared_memory is None:
+            self.conn.send(cv)
+            return
+        shm = shared_memory.SharedMemory(
+            name=self.name, create=True, size=max(cv.nbytes, 1)
+        )
+        np.ndarray(cv.shape, dtype=cv.dtype, buffer=shm.buf)[...] = cv
+        # the block is unlinked by the parent, which knows its name
+        shm.close()
+        self.conn.send((cv.shape, cv.dtype.str))
+
+    def send(self, obj) -> None:
+        self.put(obj)
+
+
+def _block_name(cycle: int, replica: int) -> str:
+    """
+    name of the shared memory block of an analysis worker. it is given by the
+    parent, so that the block of a worker which has failed can be removed
+    """
+    return f"pacs_{os.getpid()}_{cycle:03}_{replica:03}"
+
+
+def _unlink_block(name: str) -> None:
+    """
+    remove the shared memory block of a worker which has not been received
+    """
+    if shared_memory is None:
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
 
 @dataclasses.dataclass
 class SuperAnalyzer(metaclass=ABCMeta):
     CVs: List[float] = None
+    # state of the per-replica analysis workers of the current cycle
+    worker_cycle: int = None
+    # a worker is a python process sending its CV through the connection,
+    # or a command-engine job (connection is None) whose output is read afterwards
+    workers: Dict[int, Tuple[Union[mp.Process, Job], Connection]] = None
+    pending: Deque[int] = None
+    # worker slots shared with the analysis and export of the other trials
+    # (see pacs_md_trials), and whether a pending worker is waiting for one
+    slots: SlotPool = None
+    waiting_slot: bool = False
+    cv_by_replica: Dict[int, np.ndarray] = None
+    # shared memory blocks viewed by the received CVs, closed by release_blocks
+    cv_blocks: List["shared_memory.SharedMemory"] = None
+    # number of snapshots ranked for the next cycle (n_replica if None)
+    n_ranked: int = None
+    # cycle whose snapshots are being ranked
+    ranked_cycle: int = None
+    # data file written by cpptraj_actions (None if they are not implemented).
+    # not a field, so that the subclasses can override it
+    cpptraj_output = None
 
     @abstractmethod
     def calculate_cv(self, settings: MDsettings, cycle: int) -> List[float]:
         pass
 
     @abstractmethod
-    def ranking(self, settings: MDsettings, CVs: List[Snapshot]) -> List[Snapshot]:
+    def ranking(
+        self, settings: MDsettings, CVs: Snapshots
+    ) -> Union[Snapshots, List[Snapshot]]:
         pass
 
     @abstractmethod
     def is_threshold(self, settings: MDsettings, CVs: List[Snapshot] = None) -> bool:
         pass
 
-    def write_cv_to_file(
-        self, output_file: str, cv_arr: List[Snapshot], settings: MDsettings, cycle: int
-    ) -> None:
-        dir = settings.each_cycle(_cycle=cycle)
-        with open(f"{dir}/summary/{output_file}", "w") as f:
-            for snapshot in cv_arr:
-                f.write(f"{snapshot}" + "\n")
-
-    def analyze(self, settings: MDsettings, cycle: int) -> List[Snapshot]:
-        dir = settings.each_cycle(_cycle=cycle)
-        if Path(f"{dir}/summary/cv_ranked.log").exists():
-            pattern1 = r"replica (\d+) frame (\d+) cv \[([-\d.\s]+)\]"
-            pattern2 = r"replica (\d+) frame (\d+) cv ([-\d.]+)"
-            results = []
-            with open(f"{dir}/summary/cv_ranked.log", "r") as f:
-                for line in f:
-                    match1 = re.search(pattern1, line)
-                    match2 = re.search(pattern2, line)
-                    if match1:
-                        replica = int(match1.group(1))
-                        frame = int(match1.group(2))
-                        cv_values = [float(x) for x in match1.group(3).split()]
-                    elif match2:
-                        replica = int(match2.group(1))
-                        frame = int(match2.group(2))
-                        cv_values = float(match2.group(3))
-                    else:
-                        LOGGER.error(
-                            "pattern matching failed. please check the log file."
-                        )
-                        exit(1)
+    def n_top(self, settings: MDsettings) -> int:
+        """
+        number of snapshots which become the input structures of the next cycle
+        """
+        return settings.n_replica if self.n_ranked is None else self.n_ranked
 
-                    results.append(Snapshot(int(replica), int(frame), cv_values))
-            LOGGER.info("analyzer was skipped")
-            return results
-
-        queue = mp.Queue(maxsize=0)
-        cv_arr = []
-        n_loop = (settings.n_replica + settings.n_parallel - 1) // settings.n_parallel
-        replicas = [x + 1 for x in range(settings.n_replica)]
-        for i in range(n_loop):
-            job_list = []
-            for replica in replicas[
-                i
-                * settings.n_parallel : min(
-                    (i + 1) * settings.n_parallel, settings.n_replica
-                )
-            ]:
-                p = mp.Process(
-                    target=self.calculate_cv, args=(settings, cycle, replica, queue)
+    def cv_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
+        """
+        external commands calculating the CV of a replica.
+        None if the CV is calculated in python by calculate_cv
+        """
+        if settings.analyzer == "gromacs":
+            return self.gmx_commands(settings, cycle, replica)
+        elif settings.analyzer == "cpptraj":
+            return self.cpptraj_commands(settings, cycle, replica)
+        return None
+
+    def read_cv(self, settings: MDsettings, cycle: int, replica: int) -> np.ndarray:
+        """
+        read the CV written by cv_commands
+        """
+        if settings.analyzer == "gromacs":
+            return self.read_gmx(settings, cycle, replica)
+        elif settings.analyzer == "cpptraj":
+            return self.read_cpptraj(settings, cycle, replica)
+        raise NotImplementedError
+
+    def gmx_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
+        return None
+
+    def cpptraj_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
+        if self.cpptraj_output is None:
+            return None
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        trajins = [self.cpptraj_trajin(settings, dir)]
+        out = f"{dir}/{self.cpptraj_output}"
+        return [self.cpptraj_command(settings, trajins, out, dir)]
+
+    def cpptraj_actions(self, settings: MDsettings, out: str) -> List[str]:
+        """
+        cpptraj commands applied to the frames of trajin,
+        which write the frame number and the CV of each frame to out
+        """
+        raise NotImplementedError
+
+    def read_gmx(self, settings: MDsettings, cycle: int, replica: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def read_cpptraj(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> np.ndarray:
+        raise NotImplementedError
+
+    def cal_by_gmx(self, settings: MDsettings, cycle: int, replica: int) -> np.ndarray:
+        commands = self.gmx_commands(settings, cycle, replica)
+        if get_engine(settings).run(commands) != 0:
+            exit(1)
+        return self.read_gmx(settings, cycle, replica)
+
+    def cal_by_cpptraj(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> np.ndarray:
+        commands = self.cpptraj_commands(settings, cycle, replica)
+        if get_engine(settings).run(commands) != 0:
+            exit(1)
+        return self.read_cpptraj(settings, cycle, replica)
+
+    def first_frame(self, settings: MDsettings) -> int:
+        """
+        first frame of prd to be analyzed, start_frame.
+        frame 0 of gromacs is the initial structure, which is not ranked,
+        so every skip_frame-th frame is counted from frame 1 as before
+        """
+        if (
+            settings.simulator == "gromacs"
+            and settings.start_frame == 0
+            and settings.skip_frame > 1
+        ):
+            return 1
+        return settings.start_frame
+
+    def iter_trajectory(
+        self, settings: MDsettings, cycle: int, replica: int, selections: List[str]
+    ) -> Iterator[Tuple[object, List[np.ndarray]]]:
+        """
+        load the atoms of the selections in the frames of prd to be analyzed,
+        i.e. every skip_frame-th frame from first_frame. the other frames are
+        not decoded. the frames are given in chunks of chunk_size frames
+        (or as a single chunk if the chunk size is 0)
+
+        @return
+        iterator of trj:md.Trajectory and the indices of each selection in trj
+        """
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        trj_file = f"{dir}/prd{settings.trajectory_extension}"
+        chunk = self.chunk_size(settings, selections)
+        if chunk == 0:
+            yield load_selections(
+                trj_file,
+                settings.top_mdtraj,
+                selections,
+                cache_dir=settings.cache_dir(),
+                start=self.first_frame(settings),
+                stride=settings.skip_frame,
+            )
+            return
+        yield from iterload_selections(
+            trj_file,
+            settings.top_mdtraj,
+            selections,
+            chunk,
+            cache_dir=settings.cache_dir(),
+            start=self.first_frame(settings),
+            stride=settings.skip_frame,
+        )
+
+    def frame_bytes(self, settings: MDsettings, selections: List[str] = None) -> int:
+        """
+        estimated memory for a frame in the CV calculation by mdtraj
+        """
+        if selections is None:
+            selections = [settings.selection1, settings.selection2]
+        atom_indices, _ = selected_atoms(
+            settings.top_mdtraj, selections, settings.cache_dir()
+        )
+        return len(atom_indices) * FRAME_BYTES_PER_ATOM
+
+    def n_workers(self, settings: MDsettings) -> int:
+        """
+        number of CV calculations running at the same time.
+        n_parallel, reduced so that every worker can hold a chunk
+        (chunk_size or MIN_CHUNK_FRAMES frames) within analysis_memory
+        """
+        if settings.analyzer != "mdtraj" or settings.analysis_memory <= 0:
+            return settings.n_parallel
+        min_frames = (
+            settings.chunk_size if settings.chunk_size > 0 else MIN_CHUNK_FRAMES
+        )
+        budget = settings.analysis_memory * 1024**3
+        n_workers = int(budget // (min_frames * self.frame_bytes(settings)))
+        return max(1, min(settings.n_parallel, n_workers))
+
+    def chunk_size(self, settings: MDsettings, selections: List[str]) -> int:
+        """
+        number of frames read at once by a worker, 0 for the whole trajectory
+        """
+        if settings.chunk_size > 0:
+            return settings.chunk_size
+        if settings.analysis_memory <= 0:
+            return 0
+        budget = settings.analysis_memory * 1024**3 / self.n_workers(settings)
+        return max(1, int(budget // self.frame_bytes(settings, selections)))
+
+    def gmx_index(
+        self, settings: MDsettings, groups: List[str]
+    ) -> Tuple[str, str, List[str]]:
+        """
+        index files for prd_image holding only the atoms of groups
+
+        @return
+        full:str index_file with GMX_CV_GROUP, for prd.tpr and prd
+        subset:str groups renumbered for prd_image
+        names:List[str] names of groups in both index files
+        """
+        return index_subset(
+            str(settings.index_file), groups, GMX_CV_GROUP, settings.cache_dir()
+        )
+
+    def gmx_image_command(
+        self, settings: MDsettings, dir: str, groups: List[str] = None
+    ) -> Command:
+        """
+        make molecules whole (or nojump) into prd_image for gmx analysis tools.
+        if groups are given, only their atoms (GMX_CV_GROUP) are written, so that
+        the solvent is not written and read again
+        """
+        extension = settings.trajectory_extension
+
+        # nojump treatment
+        if settings.nojump is True:
+            pbc_option = "-pbc nojump"
+        else:
+            pbc_option = "-pbc mol -ur compact"
+
+        # only the frames to be analyzed are passed to the gmx analysis tools
+        frame_option = ""
+        first_frame = self.first_frame(settings)
+        if first_frame > 0:
+            # half a frame earlier, so that the rounding of the time keeps the frame
+            begin = self.gmx_frame_time(settings, first_frame - 0.5)
+            frame_option += f" -b {begin}"
+        if settings.skip_frame > 1:
+            frame_option += f" -skip {settings.skip_frame}"
+
+        output_group = "System"
+        if groups is not None:
+            full, _, _ = self.gmx_index(settings, groups)
+            frame_option += f" -n {full}"
+            output_group = GMX_CV_GROUP
+
+        cmd_image = f"{settings.cmd_gmx} trjconv \
+                -f {dir}/prd{extension} \
+                -s {dir}/prd.tpr \
+                -o {dir}/prd_image{extension} \
+                {pbc_option}{frame_option}"  # NOQA: E221
+        return Command(
+            cmd=cmd_image,
+            stdin=f"{output_group}\n",
+            log=f"{dir}/image.log",
+            timeout=settings.command_timeout or None,
+            errors=["error occurred at image command", f"see {dir}/image.log"],
+        )
+
+    def gmx_subset_command(
+        self, settings: MDsettings, structure: str, groups: List[str], out_file: str
+    ) -> Command:
+        """
+        write the atoms of groups in structure, which match the atoms of
+        prd_image written with groups, for the tools reading both of them
+        """
+        full, _, _ = self.gmx_index(settings, groups)
+        out_dir = Path(out_file).parent
+        cmd_subset = f"{settings.cmd_gmx} editconf \
+                -f {structure} \
+                -n {full} \
+                -o {out_file}"  # NOQA: E221
+        return Command(
+            cmd=cmd_subset,
+            stdin=f"{GMX_CV_GROUP}\n",
+            log=f"{out_dir}/subset.log",
+            timeout=settings.command_timeout or None,
+            errors=["error occurred at editconf command", f"see {out_dir}/subset.log"],
+        )
+
+    def gmx_frame_time(self, settings: MDsettings, frame: float) -> float:
+        """
+        time (ps) of a frame of prd, given by tinit, dt and the output interval
+        of the trajectory in mdconf
+        """
+        params: Dict[str, str] = {}
+        with open(settings.mdconf, "r") as f:
+            for line in f:
+                line = line.split(";")[0]
+                if "=" in line:
+                    key, value = line.split("=", 1)
+                    params[key.strip().lower().replace("_", "-")] = value.strip()
+        if settings.trajectory_extension == ".xtc":
+            nstout = params.get("nstxout-compressed", params.get("nstxtcout", "0"))
+        else:
+            nstout = params.get("nstxout", "0")
+        if int(nstout) <= 0:
+            LOGGER.error(
+                f"output interval of prd{settings.trajectory_extension} "
+                f"is not found in {settings.mdconf}"
+            )
+            exit(1)
+        tinit = float(params.get("tinit", "0"))
+        dt = float(params.get("dt", "0.001"))
+        return tinit + frame * dt * int(nstout)
+
+    def cpptraj_trajin(self, settings: MDsettings, dir: str) -> str:
+        """
+        trajin of prd reading every skip_frame-th frame from first_frame
+        (1-indexed in cpptraj)
+        """
+        return (
+            f"trajin {dir}/prd{settings.trajectory_extension} "
+            f"{self.first_frame(settings) + 1} last {settings.skip_frame}"
+        )
+
+    def cpptraj_command(
+        self, settings: MDsettings, trajins: List[str], out: str, dir: str
+    ) -> Command:
+        """
+        a cpptraj run loading the topology once and applying cpptraj_actions
+        to the frames of all trajins. the script and the log are written in dir
+        """
+        cmd_cpptraj = [
+            f"parm {settings.topology}",
+            *trajins,
+            *self.cpptraj_actions(settings, out),
+            "run",
+            "quit",
+        ]
+        with open(f"{dir}/calCV.cpptraj", "w") as f:
+            f.write("\n".join(cmd_cpptraj))
+
+        return Command(
+            cmd=f"{settings.cmd_cpptraj} -i {dir}/calCV.cpptraj --log {dir}/calCV.log",
+            log=f"{dir}/calCV.log",
+            timeout=settings.command_timeout or None,
+            errors=[
+                "error occurred at cpptraj command",
+                f"see {dir}/calCV.log for details",
+            ],
+        )
+
+    def cpptraj_n_frames(self, settings: MDsettings, dir: str) -> int:
+        """
+        number of frames of prd read by cpptraj_trajin
+        """
+        import mdtraj as md
+
+        with md.open(f"{dir}/prd{settings.trajectory_extension}") as f:
+            n_frames = len(f)
+        return len(range(self.first_frame(settings), n_frames, settings.skip_frame))
+
+    def is_cycle_batch(self, settings: MDsettings) -> bool:
+        """
+        whether the CVs of all replicas of a cycle are calculated by a cpptraj run
+        """
+        return settings.analyzer == "cpptraj" and self.cpptraj_output is not None
+
+    def cpptraj_cycle_commands(
+        self, settings: MDsettings, cycle: int, replicas: List[int]
+    ) -> List[Command]:
+        """
+        a cpptraj run over the trajectories of replicas in cycleXXX/summary.
+        cpptraj writes the CVs of all frames into a data file, which is split
+        into cpptraj_output of each replica afterwards, as read by read_cpptraj.
+        None if the number of frames of a trajectory is not known in advance
+        """
+        dirs = [settings.each_replica(_cycle=cycle, _replica=rep) for rep in replicas]
+        try:
+            n_frames = [self.cpptraj_n_frames(settings, dir) for dir in dirs]
+        except Exception as e:
+            LOGGER.warning(f"cpptraj is run for each replica ({type(e).__name__}: {e})")
+            return None
+
+        summary = f"{settings.each_cycle(_cycle=cycle)}/summary"
+        Path(summary).mkdir(parents=True, exist_ok=True)
+        out = f"{summary}/{self.cpptraj_output}"
+        trajins = [self.cpptraj_trajin(settings, dir) for dir in dirs]
+
+        def split_cpptraj_output() -> None:
+            data = np.loadtxt(out, ndmin=2)
+            if len(data) != sum(n_frames):
+                raise ValueError(
+                    f"{out} has {len(data)} frames, but {sum(n_frames)} are expected"
                 )
-                job_list.append(p)
-                p.start()
+            for dir, rows in zip(dirs, np.split(data, np.cumsum(n_frames)[:-1])):
+                # renumber the frames from 1 as in the output for a replica
+                rows[:, 0] = np.arange(1, len(rows) + 1)
+                np.savetxt(f"{dir}/{self.cpptraj_output}", rows, fmt="%.8g")
+
+        return [
+            self.cpptraj_command(settings, trajins, out, summary),
+            Command(func=split_cpptraj_output),
+        ]
+
+    def reset_workers(self, cycle: int) -> None:
+        self.worker_cycle = cycle
+        self.workers = {}
+        self.pending = deque()
+        self.cv_by_replica = {}
+        self.waiting_slot = False
 
-            for _ in range(len(job_list)):
-                cv_arr.append(queue.get())
+    def submit(self, settings: MDsettings, cycle: int, replica: int) -> None:
+        """
+        queue the CV calculation of a replica whose MD has finished.
+        at most n_workers calculations run at the same time.
+        """
+        if self.worker_cycle != cycle:
+            self.reset_workers(cycle)
+        if replica in self.cv_by_replica or replica in self.workers:
+            return
+        if self.is_cycle_batch(settings):
+            # all replicas are analyzed at once by collect
+            return
+        if replica not in self.pending:
+            self.pending.append(replica)
+        self.dispatch(settings, cycle, block=False)
 
-            for proc in job_list:
-                proc.join()
+    def receive(
+        self, name: str, message: Union[Tuple[Tuple[int, ...], str], np.ndarray]
+    ) -> np.ndarray:
+        """
+        the CVs sent by _Sender as a view of its shared memory block (not copied).
+        the name of the block is removed at once, and its memory is freed
+        when the block is closed by release_blocks
+        """
+        if shared_memory is None:
+            return message
+        shape, dtype = message
+        shm = shared_memory.SharedMemory(name=name)
+        shm.unlink()
+        if self.cv_blocks is None:
+            self.cv_blocks = []
+        self.cv_blocks.append(shm)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
 
-            for proc in job_list:
-                if proc.exitcode != 0:
-                    LOGGER.error("error occurred at child process")
+    def release_blocks(self) -> None:
+        """
+        close the blocks of the received CVs, which must not be used any more
+        """
+        for shm in self.cv_blocks or []:
+            shm.close()
+        self.cv_blocks = None
+
+    def dispatch(self, settings: MDsettings, cycle: int, block: bool) -> None:
+        """
+        receive the results of finished workers and start pending ones.
+        if block is True, wait until at least one worker has finished.
+        """
+        waitables = {}
+        for replica, (worker, conn) in self.workers.items():
+            waitables[conn if conn is not None else worker.sentinel] = replica
+        if self.waiting_slot:
+            waitables[self.slots.fileno()] = None
+        if len(waitables) > 0:
+            for ready in wait(list(waitables.keys()), timeout=None if block else 0):
+                replica = waitables[ready]
+                if replica is None:
+                    # a slot is freed by the other trials
+                    continue
+                worker, conn = self.workers.pop(replica)
+                if conn is not None:
+                    try:
+                        self.cv_by_replica[replica] = self.receive(
+                            _block_name(cycle, replica), conn.recv()
+                        )
+                    except EOFError:
+                        # the worker exited without sending its result
+                        pass
+                    conn.close()
+                worker.join()
+                if worker.exitcode == 0 and conn is None:
+                    self.cv_by_replica[replica] = self.read_cv(settings, cycle, replica)
+                if worker.exitcode != 0 or replica not in self.cv_by_replica:
+                    LOGGER.error(f"error occurred at analysis of replica{replica:03}")
+                    self.workers[replica] = (worker, conn)
+                    self.terminate_workers(cycle)
                     exit(1)
+                worker.close()
+                if self.slots is not None:
+                    self.slots.release()
+
+        n_workers = self.n_workers(settings)
+        self.waiting_slot = False
+        while len(self.pending) > 0 and len(self.workers) < n_workers:
+            if self.slots is not None and not self.slots.acquire(block=False):
+                # all slots are used by the other trials
+                self.waiting_slot = True
+                break
+            replica = self.pending.popleft()
+            commands = self.cv_commands(settings, cycle, replica)
+            if commands is not None:
+                job = get_engine(settings).submit(commands)
+                self.workers[replica] = (job, None)
+                continue
+            # the workers register their blocks to the resource tracker of
+            # this process, which is unregistered when the block is unlinked
+            if resource_tracker is not None:
+                resource_tracker.ensure_running()
+            recv_conn, send_conn = mp.Pipe(duplex=False)
+            process = mp.Process(
+                target=self.calculate_cv,
+                args=(
+                    settings,
+                    cycle,
+                    replica,
+                    _Sender(send_conn, _block_name(cycle, replica)),
+                ),
+            )
+            process.start()
+            # close the parent's copy so that recv() fails if the worker dies
+            send_conn.close()
+            self.workers[replica] = (process, recv_conn)
 
-            # Not necessary, but just in case.
-            for proc in job_list:
-                proc.close()
+    def terminate_workers(self, cycle: int) -> None:
+        """
+        stop the running workers and remove the blocks they may have written
+        """
+        for replica, (worker, conn) in self.workers.items():
+            worker.terminate()
+            if conn is not None:
+                worker.join()
+                _unlink_block(_block_name(cycle, replica))
+        self.workers = {}
 
-        # just in case
-        queue.close()
-        queue.join_thread()
+    def collect(self, settings: MDsettings, cycle: int) -> List[np.ndarray]:
+        """
+        calculate the CVs of all replicas which have not been submitted yet
+        and return the CVs in the order of replicas
+        """
+        if self.worker_cycle != cycle:
+            self.reset_workers(cycle)
+        if self.is_cycle_batch(settings):
+            self.collect_cycle_batch(settings, cycle)
+        for replica in range(1, settings.n_replica + 1):
+            self.submit(settings, cycle, replica)
+        while len(self.cv_by_replica) < settings.n_replica:
+            self.dispatch(settings, cycle, block=True)
+        cv_arr = [
+            self.cv_by_replica[replica] for replica in range(1, settings.n_replica + 1)
+        ]
+        self.reset_workers(None)
+        return cv_arr
+
+    def collect_cycle_batch(self, settings: MDsettings, cycle: int) -> None:
+        """
+        calculate the CVs of all replicas by a cpptraj run,
+        or queue a cpptraj run for each replica if it is not possible
+        """
+        replicas = [
+            rep
+            for rep in range(1, settings.n_replica + 1)
+            if rep not in self.cv_by_replica
+        ]
+        commands = self.cpptraj_cycle_commands(settings, cycle, replicas)
+        if commands is None:
+            self.pending.extend(rep for rep in replicas if rep not in self.pending)
+            return
+        if self.slots is not None:
+            self.slots.acquire()
+        if get_engine(settings).run(commands) != 0:
+            LOGGER.error(f"error occurred at analysis of cycle{cycle:03}")
+            exit(1)
+        if self.slots is not None:
+            self.slots.release()
+        for replica in replicas:
+            self.cv_by_replica[replica] = self.read_cv(settings, cycle, replica)
+
+    def analyze(
+        self, settings: MDsettings, cycle: int
+    ) -> Union[Snapshots, List[Snapshot]]:
+        if cvstore.exists(settings, cycle, "cv_ranked"):
+            LOGGER.info("analyzer was skipped")
+            return cvstore.read(settings, cycle, "cv_ranked")
+
+        cv_arr = self.collect(settings, cycle)
         assert len(cv_arr) == settings.n_replica
 
-        cv_arr = np.array(cv_arr)
-        if len(cv_arr.shape) == 2:
-            cv_arr = cv_arr.flatten()
-        else:
-            cv_arr = cv_arr.reshape(-1, cv_arr.shape[-1])
-        n_frame = len(cv_arr) // settings.n_replica
-
-        results: List[Snapshot] = []
-        iter = 0
-        for rep in range(1, settings.n_replica + 1):
-            for frame in range(0, n_frame):
-                snapshot = Snapshot(rep, frame, cv_arr[iter])
-                iter += 1
-                # Exclude the first frame of the trajectory file in gromacs
-                # because it is the initial structure
-                if settings.simulator == "gromacs" and frame == 0:
-                    continue
-                results.append(snapshot)
+        # the number of frames is counted for each replica,
+        # since the trajectories of the replicas may differ in length
+        n_frames = {
+            rep: len(cv_arr[rep - 1]) for rep in range(1, settings.n_replica + 1)
+        }
+        if settings.start_frame == 0 and settings.skip_frame == 1:
+            # all frames of the trajectories have been read
+            state.record_n_frames(
+                settings, cycle, f"prd{settings.trajectory_extension}", n_frames
+            )
+
+        # the CVs are calculated only for every skip_frame-th frame from first_frame
+        replica = np.concatenate(
+            [np.full(n_frames[rep], rep) for rep in range(1, settings.n_replica + 1)]
+        )
+        frame = np.concatenate(
+            [
+                self.first_frame(settings)
+                + np.arange(n_frames[rep]) * settings.skip_frame
+                for rep in range(1, settings.n_replica + 1)
+            ]
+        )
+        cv = np.concatenate(cv_arr)
+        # cv_arr may view the shared memory blocks of the workers
+        del cv_arr
+        self.release_blocks()
+        # Exclude the first frame of the trajectory file in gromacs
+        # because it is the initial structure
+        if settings.simulator == "gromacs":
+            keep = frame != 0
+            replica, frame, cv = replica[keep], frame[keep], cv[keep]
+        results = Snapshots.from_arrays(replica, frame, cv)
 
-        self.write_cv_to_file("cv.log", results, settings, cycle)
-        self.CVs = results[:: settings.skip_frame]
-        self.CVs = self.ranking(settings, self.CVs)
-        self.write_cv_to_file("cv_ranked.log", self.CVs, settings, cycle)
+        cvstore.write(settings, cycle, "cv", results)
+        self.ranked_cycle = cycle
+        self.CVs = self.ranking(settings, results)
+        cvstore.write(settings, cycle, "cv_ranked", self.CVs)
+        state.record(settings, cycle, "analyze")
         LOGGER.info(f"The top ranking CV is {self.CVs[0]}")
 
         return self.CVs
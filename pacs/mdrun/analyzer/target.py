@@ -5,18 +5,21 @@ https://doi.org/10.1063/1.4813023
 """
 
 import multiprocessing as mp
-import subprocess
 from typing import List
 
 import numpy as np
 from pacs.mdrun.analyzer.superAnalyzer import SuperAnalyzer
-from pacs.models.settings import MDsettings, Snapshot
+from pacs.models.settings import MDsettings, Snapshot, Snapshots
+from pacs.utils.engine import Command, remove_files
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_reference, select
 
 LOGGER = generate_logger(__name__)
 
 
 class Target(SuperAnalyzer):
+    cpptraj_output = "rms.xvg"
+
     def calculate_cv(
         self, settings: MDsettings, cycle: int, replica: int, queue: mp.Queue
     ) -> List[float]:
@@ -31,138 +34,104 @@ class Target(SuperAnalyzer):
         queue.put(ret)
         return ret
 
-    def ranking(self, settings: MDsettings, CVs: List[Snapshot]) -> List[Snapshot]:
-        sorted_cv = sorted(CVs, key=lambda x: x.cv)
+    def ranking(self, settings: MDsettings, CVs: Snapshots) -> Snapshots:
+        sorted_cv = CVs.top(self.n_top(settings))
         return sorted_cv
 
     def is_threshold(self, settings: MDsettings, CVs: List[Snapshot] = None) -> bool:
         return CVs[0].cv < settings.threshold
 
     def cal_by_mdtraj(self, settings: MDsettings, cycle: int, replica: int) -> None:
-        import mdtraj as md
-
-        ref = md.load(settings.reference)
-        dir = settings.each_replica(_cycle=cycle, _replica=replica)
-        trj = md.load(
-            f"{dir}/prd{settings.trajectory_extension}",
-            top=settings.top_mdtraj,
-        )
-        trj.superpose(
-            ref,
-            0,
-            atom_indices=trj.top.select(settings.selection1),
-            ref_atom_indices=ref.top.select(settings.selection3),
-        )
-        # md.rmsd performs superposition automatically, so we don't use that typeality here
-        rmsd = np.sqrt(
-            3
-            * np.mean(
-                np.square(
-                    trj.xyz[:, trj.top.select(settings.selection2)]
-                    - ref.xyz[:, ref.top.select(settings.selection4)]
-                ),
-                axis=(1, 2),
+        cache_dir = settings.cache_dir()
+        ref = load_reference(settings.reference, cache_dir=cache_dir)
+        ref_fit_index = select(settings.reference, settings.selection3, cache_dir)
+        ref_cal_index = select(settings.reference, settings.selection4, cache_dir)
+        rmsd = []
+        for trj, (fit_index, cal_index) in self.iter_trajectory(
+            settings, cycle, replica, [settings.selection1, settings.selection2]
+        ):
+            trj.superpose(
+                ref,
+                0,
+                atom_indices=fit_index,
+                ref_atom_indices=ref_fit_index,
             )
-        )
-        return rmsd
+            # md.rmsd performs superposition automatically, so we don't use that typeality here
+            rmsd.append(
+                np.sqrt(
+                    3
+                    * np.mean(
+                        np.square(trj.xyz[:, cal_index] - ref.xyz[:, ref_cal_index]),
+                        axis=(1, 2),
+                    )
+                )
+            )
+        return np.concatenate(rmsd)
 
-    def cal_by_gmx(self, settings: MDsettings, cycle: int, replica: int) -> None:
+    def gmx_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
         extension = settings.trajectory_extension
         selection1 = settings.selection1
         selection2 = settings.selection2
-        ndx = settings.index_file
-        ref = settings.reference
         dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        groups = [selection1, selection2]
+        # prd_image holds only the atoms of the groups, so the reference and
+        # the index groups are reduced to the same atoms
+        _, ndx, (selection1, selection2) = self.gmx_index(settings, groups)
+        ref = f"{dir}/reference_subset.gro"
 
-        # nojump treatment
-        if settings.nojump is True:
-            pbc_option = "-pbc nojump"
-        else:
-            pbc_option = "-pbc mol -ur compact"
-
-        cmd_image = f"echo 'System' \
-                | {settings.cmd_gmx} trjconv \
-                -f {dir}/prd{extension} \
-                -s {dir}/prd.tpr \
-                -o {dir}/prd_image{extension} \
-                {pbc_option} \
-                1> {dir}/image.log 2>&1"  # NOQA: E221
-
-        res_image = subprocess.run(cmd_image, shell=True)
-        if res_image.returncode != 0:
-            LOGGER.error("error occurred at image command")
-            LOGGER.error(f"see {dir}/image.log")
-            exit(1)
-
-        cmd_rms = f"echo {selection1} {selection2} \
-                | {settings.cmd_gmx} rms \
+        cmd_rms = f"{settings.cmd_gmx} rms \
                 -f {dir}/prd_image{extension} \
                 -s {ref} \
                 -o {dir}/rms.xvg \
                 -n {ndx} \
                 -pbc no \
                 -nomw \
-                -xvg none 1> {dir}/rms.log 2>&1"  # NOQA: E221
-        res_rms = subprocess.run(cmd_rms, shell=True)
-
-        if res_rms.returncode != 0:
-            LOGGER.error("error occured at rms command")
-            LOGGER.error(f"see {dir}/rms.log")
-            exit(1)
-
-        cmd_rmfile = f"rm {dir}/prd_image{extension}"
-        subprocess.run(cmd_rmfile, shell=True)
+                -xvg none"  # NOQA: E221
+        return [
+            self.gmx_image_command(settings, dir, groups),
+            self.gmx_subset_command(settings, settings.reference, groups, ref),
+            Command(
+                cmd=cmd_rms,
+                stdin=f"{selection1} {selection2}\n",
+                log=f"{dir}/rms.log",
+                timeout=settings.command_timeout or None,
+                errors=["error occured at rms command", f"see {dir}/rms.log"],
+            ),
+            Command(func=remove_files(f"{dir}/prd_image{extension}", ref), check=False),
+        ]
 
+    def read_gmx(self, settings: MDsettings, cycle: int, replica: int) -> np.ndarray:
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        # output of rms command will be tsv-like format
         rmsd_rep = np.loadtxt(f"{dir}/rms.xvg", dtype="float32")[:, 1]
         return rmsd_rep
-        # output of rms command will be tsv-like format
-
-    def cal_by_cpptraj(
-        self, settings: MDsettings, cycle: int, replica: int
-    ) -> List[float]:
-        dir = settings.each_replica(_cycle=cycle, _replica=replica)
 
-        # Construct the cpptraj command
+    def cpptraj_actions(self, settings: MDsettings, out: str) -> List[str]:
         # selection3, 4 are available
         # cmd_cpptraj = [
-        #     f"parm {settings.topology}",
-        #     f"trajin {dir}/prd{settings.trajectory_extension}",
         #     # f"center {settings.centering_selection}",
         #     f"image",
         #     f"reference {settings.reference} [refstr]",
-        #     f"rms fitting {settings.selection1} {settings.selection3} mass ref [refstr]",
+        #     f"rms fitting {settings.selection1} {settings.selection3}\
+        #        mass ref [refstr]",
         #     f"rms rmsd {settings.selection2} {settings.selection4}\
-        #        mass nofit out {dir}/rms.xvg",
-        #     "run",
-        #     "quit"
+        #        mass nofit out {out}",
         # ]
 
         # selection3, 4 are not available
-        cmd_cpptraj = [
-            f"parm {settings.topology}",
-            f"trajin {dir}/prd{settings.trajectory_extension}",
+        return [
             f"center {settings.centering_selection}",
             "image",
             f"reference {settings.reference} [refstr]",
             f"rms fit ref [refstr] {settings.selection1}",
-            f"rms cal ref [refstr] {settings.selection2} \
-                    nofit out {dir}/rms.xvg",
-            "run",
-            "quit",
+            f"rms cal ref [refstr] {settings.selection2} nofit out {out}",
         ]
 
-        with open(f"{dir}/calCV.cpptraj", "w") as f:
-            f.write("\n".join(cmd_cpptraj))
-
-        res_cpptraj = subprocess.run(
-            f"cpptraj -i {dir}/calCV.cpptraj 1> {dir}/rms.log 2>&1 --log {dir}/rms.log",
-            shell=True,
-        )
-
-        if res_cpptraj.returncode != 0:
-            LOGGER.error("error occurred at cpptraj command")
-            LOGGER.error(f"see {dir}/rms.log for details")
-            exit(1)
-
-        rmsd = np.loadtxt(f"{dir}/rms.xvg", dtype="float32")[:, 1]
+    def read_cpptraj(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> np.ndarray:
+        dir = settings.each_replica(_cycle=cycle, _replica=replica)
+        rmsd = np.loadtxt(f"{dir}/{self.cpptraj_output}", dtype="float32")[:, 1]
         return rmsd
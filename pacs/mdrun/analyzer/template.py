@@ -1,7 +1,7 @@
 from typing import List
 
 from pacs.mdrun.analyzer.superAnalyzer import SuperAnalyzer
-from pacs.models.settings import MDsettings, Snapshot
+from pacs.models.settings import MDsettings, Snapshot, Snapshots
 from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
@@ -14,23 +14,29 @@ class Template(SuperAnalyzer):
         """
         TODO
         1. Read trajectory based on self.cycle
+           (only every skip_frame-th frame from self.first_frame(settings),
+           e.g. by self.iter_trajectory(settings, cycle, replica, selections))
         2. Calculate the value that suited the evaluation type.
         3. send the values by send_rev.send(ret_arr)
         """
         pass
 
-    def ranking(self, settings: MDsettings, CVs: List[Snapshot]) -> List[Snapshot]:
+    def ranking(self, settings: MDsettings, CVs: Snapshots) -> List[Snapshot]:
         """
         settings: MDsettings
             The settings object contains the parameters for the analysis.
-        CVs: List[Snapshot]
-            The cv_arr is a list of Snapshot objects
-            that contain the CV for each frame in the trajectory.
+        CVs: Snapshots
+            The CVs is a table of the snapshots of all frames in the trajectories
+            (arrays CVs.replica, CVs.frame and CVs.cv).
+            Iterating over it or indexing it gives Snapshot objects.
         TODO:
             Arrange them in ascending, descending, etc.
             order to match the PaCSMD evaluation type.
+            Only the first n_replica snapshots are used for the next cycle.
         Example:
-        sorted_cv = sorted(cv_arr, key=lambda x: x.cv)
+        sorted_cv = CVs.top(self.n_top(settings))
+        or
+        sorted_cv = sorted(CVs, key=lambda x: x.cv)
         return sorted_cv
         """
         pass
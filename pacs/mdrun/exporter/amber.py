@@ -1,10 +1,11 @@
 import dataclasses
-import subprocess
 from typing import List
 
 from pacs.mdrun.exporter.superExporter import SuperExporter
 from pacs.models.settings import MDsettings, Snapshot
+from pacs.utils.engine import Command, get_engine
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_topology, select
 
 LOGGER = generate_logger(__name__)
 
@@ -35,17 +36,20 @@ class eAmber(SuperExporter):
         import mdtraj as md
 
         extension = settings.trajectory_extension
+        cache_dir = settings.cache_dir()
         from_dir = settings.each_replica(
             _cycle=cycle, _replica=results[replica_rank].replica
         )
         selected_frame = md.load_frame(
             f"{from_dir}/prd{extension}",
             index=results[replica_rank].frame,
-            top=settings.top_mdtraj,
+            top=load_topology(settings.top_mdtraj, cache_dir),
         )
         out_dir = settings.each_replica(_cycle=cycle + 1, _replica=replica_rank + 1)
         if settings.centering:
-            atom_indices = selected_frame.topology.select(settings.centering_selection)
+            atom_indices = select(
+                settings.top_mdtraj, settings.centering_selection, cache_dir
+            )
             anchors = [
                 set(
                     [
@@ -57,6 +61,17 @@ class eAmber(SuperExporter):
             selected_frame.image_molecules(anchor_molecules=anchors, inplace=True)
         selected_frame.save(f"{out_dir}/input{settings.structure_extension}")
 
+    def export_commands(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        replica_rank: int,
+        results: List[Snapshot],
+    ) -> List[Command]:
+        if settings.analyzer == "cpptraj":
+            return self.cpptraj_commands(settings, cycle, replica_rank, results)
+        return None
+
     def export_by_cpptraj(
         self,
         settings: MDsettings,
@@ -64,6 +79,17 @@ class eAmber(SuperExporter):
         replica_rank: int,
         results: List[Snapshot],
     ) -> None:
+        commands = self.cpptraj_commands(settings, cycle, replica_rank, results)
+        if get_engine(settings).run(commands) != 0:
+            exit(1)
+
+    def cpptraj_commands(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        replica_rank: int,
+        results: List[Snapshot],
+    ) -> List[Command]:
         extension = settings.trajectory_extension
         from_dir = settings.each_replica(
             _cycle=cycle, _replica=results[replica_rank].replica
@@ -95,12 +121,16 @@ class eAmber(SuperExporter):
             ]
         with open(f"{out_dir}/export.cpptraj", "w") as f:
             f.write("\n".join(cmd_cpptraj))
-        res_cpptraj = subprocess.run(
-            f"cpptraj -i {out_dir}/export.cpptraj \
-                    1> {out_dir}/export.log 2>&1 --log {out_dir}/export.log",
-            shell=True,
-        )  # NOQA: E221
-        if res_cpptraj.returncode != 0:
-            LOGGER.error("error occurred at cpptraj command")
-            LOGGER.error(f"see {out_dir}/cpptraj.log for details")
-            exit(1)
+        return [
+            Command(
+                cmd=f"{settings.cmd_cpptraj} \
+                    -i {out_dir}/export.cpptraj \
+                    --log {out_dir}/export.log",  # NOQA: E221
+                log=f"{out_dir}/export.log",
+                timeout=settings.command_timeout or None,
+                errors=[
+                    "error occurred at cpptraj command",
+                    f"see {out_dir}/export.log for details",
+                ],
+            )
+        ]
@@ -4,6 +4,7 @@ from typing import List
 from pacs.mdrun.exporter.superExporter import SuperExporter
 from pacs.models.settings import MDsettings, Snapshot
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_topology, select
 
 LOGGER = generate_logger(__name__)
 
@@ -28,19 +29,20 @@ class eNamd(SuperExporter):
         import mdtraj as md
 
         extension = settings.trajectory_extension
+        cache_dir = settings.cache_dir()
         from_dir = settings.each_replica(
             _cycle=cycle, _replica=results[replica_rank].replica
         )
         selected_frame = md.load_frame(
             f"{from_dir}/prd{extension}",
             index=results[replica_rank].frame,
-            top=settings.top_mdtraj,
+            top=load_topology(settings.top_mdtraj, cache_dir),
         )
         out_dir = settings.each_replica(_cycle=cycle + 1, _replica=replica_rank + 1)
         if settings.centering is True:
             com = md.compute_center_of_mass(
                 selected_frame.atom_slice(
-                    selected_frame.topology.select(settings.centering_selection)
+                    select(settings.top_mdtraj, settings.centering_selection, cache_dir)
                 )
             )
             selected_frame.xyz = selected_frame.xyz - com
@@ -1,17 +1,25 @@
 import dataclasses
 import multiprocessing as mp
-import re
 from abc import ABCMeta, abstractmethod
-from typing import List
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Tuple, Union
 
+import pacs.utils.cvstore as cvstore
 from pacs.models.settings import MDsettings, Snapshot
+from pacs.utils.engine import Command, Job, get_engine
 from pacs.utils.logger import generate_logger
+from pacs.utils.slots import SlotPool
 
 LOGGER = generate_logger(__name__)
 
 
 @dataclasses.dataclass
 class SuperExporter(metaclass=ABCMeta):
+    # worker slots shared with the analysis and export of the other trials
+    # (see pacs_md_trials)
+    slots: SlotPool = None
+
     @abstractmethod
     def export_each(
         self,
@@ -22,29 +30,31 @@ class SuperExporter(metaclass=ABCMeta):
     ) -> None:
         pass
 
-    def export(self, settings: MDsettings, cycle: int) -> None:
-        pattern1 = r"replica (\d+) frame (\d+) cv \[([-\d.\s]+)\]"
-        pattern2 = r"replica (\d+) frame (\d+) cv ([-\d.]+)"
-        results = []
-        dir = settings.each_cycle(_cycle=cycle)
-        with open(f"{dir}/summary/cv_ranked.log", "r") as f:
-            for line in f:
-                match1 = re.search(pattern1, line)
-                match2 = re.search(pattern2, line)
-                if match1:
-                    replica = int(match1.group(1))
-                    frame = int(match1.group(2))
-                    cv_values = [float(x) for x in match1.group(3).split()]
-                elif match2:
-                    replica = int(match2.group(1))
-                    frame = int(match2.group(2))
-                    cv_values = float(match2.group(3))
-                else:
-                    LOGGER.error("pattern matching failed.")
-                    LOGGER.error(f"see {dir}/summary/cv_ranked.log")
-                    exit(1)
+    def export_commands(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        replica_rank: int,
+        results: List[Snapshot],
+    ) -> List[Command]:
+        """
+        external commands exporting the input structure of a replica.
+        None if it is exported in python by export_each
+        """
+        return None
 
-                results.append(Snapshot(int(replica), int(frame), cv_values))
+    def export(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        on_exported: Callable[[int], None] = None,
+    ) -> None:
+        """
+        on_exported is called with the replica number of the next cycle
+        every time its input structure has been written
+        """
+        # read once here, the children share the memory-mapped store
+        results = cvstore.read(settings, cycle, "cv_ranked")
 
         if settings.n_replica > len(results):
             LOGGER.error(
@@ -53,27 +63,53 @@ class SuperExporter(metaclass=ABCMeta):
             )
             exit(1)
 
-        n_loop = (settings.n_replica + settings.n_parallel - 1) // settings.n_parallel
-        replicas = [i for i in range(settings.n_replica)]
-        for i in range(n_loop):
-            processes = []
-            for rep in replicas[
-                i
-                * settings.n_parallel : min(
-                    (i + 1) * settings.n_parallel, settings.n_replica
-                )
-            ]:
-                p = mp.Process(
-                    target=self.export_each, args=(settings, cycle, rep, results)
-                )
-                p.start()
-                processes.append(p)
-            for p in processes:
-                p.join()
-            for p in processes:
-                if p.exitcode != 0:
-                    LOGGER.error("error occurred at child process")
-                    exit(1)
-            # Not necessary, but just in case.
-            for p in processes:
-                p.close()
+        # Rolling window: start the next export as soon as any slot frees up
+        pending = deque(range(settings.n_replica))
+        running: Dict[int, Tuple[Union[mp.Process, Job], int]] = {}
+        # slots held by the running exports. they are given back here even if
+        # the export fails, since it may run in a background process
+        n_held = 0
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                waiting_slot = False
+                while len(pending) > 0 and len(running) < settings.n_parallel:
+                    if self.slots is not None:
+                        if not self.slots.acquire(block=False):
+                            # all slots are used by the other trials
+                            waiting_slot = True
+                            break
+                        n_held += 1
+                    rep = pending.popleft()
+                    commands = self.export_commands(settings, cycle, rep, results)
+                    if commands is not None:
+                        p = get_engine(settings).submit(commands)
+                    else:
+                        p = mp.Process(
+                            target=self.export_each,
+                            args=(settings, cycle, rep, results),
+                        )
+                        p.start()
+                    running[p.sentinel] = (p, rep)
+                waitables = list(running.keys())
+                if waiting_slot:
+                    waitables.append(self.slots.fileno())
+                for sentinel in wait(waitables):
+                    if sentinel not in running:
+                        # a slot is freed by the other trials
+                        continue
+                    p, rep = running.pop(sentinel)
+                    p.join()
+                    if p.exitcode != 0:
+                        LOGGER.error("error occurred at child process")
+                        for other, _ in running.values():
+                            other.terminate()
+                        exit(1)
+                    p.close()
+                    if self.slots is not None:
+                        self.slots.release()
+                        n_held -= 1
+                    if on_exported is not None:
+                        on_exported(rep + 1)
+        finally:
+            if n_held > 0:
+                self.slots.release(n_held)
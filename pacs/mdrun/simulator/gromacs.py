@@ -1,62 +1,200 @@
-import multiprocessing as mp
+import hashlib
+import os
+import re
 import subprocess
-import time as module_time
+from functools import lru_cache
 from pathlib import Path
 from typing import List
 
 from pacs.mdrun.simulator.superSimulator import SuperSimulator
 from pacs.models.settings import MDsettings
+from pacs.utils.engine import Command, get_engine
 from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
 
+INCLUDE = re.compile(r'\s*#\s*include\s+"([^"]+)"')
+DATA_PREFIX = re.compile(r"^\s*Data prefix:\s*(.+?)\s*$", re.MULTILINE)
+
+
+@lru_cache(maxsize=None)
+def gmx_version(cmd_gmx: str) -> str:
+    """
+    output of gmx --version, which is run once per cmd_gmx.
+    empty if gmx cannot be run
+    """
+    try:
+        res = subprocess.run(
+            f"{cmd_gmx} --version", shell=True, capture_output=True, text=True
+        )
+    except OSError:
+        return ""
+    return res.stdout if res.returncode == 0 else ""
+
 
 class GROMACS(SuperSimulator):
-    def run_md(self, settings: MDsettings, cycle: int, replica: int) -> None:
+    def md_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
         dir = settings.each_replica(_cycle=cycle, _replica=replica)
-        self.run_grompp(settings, dir)
-        cmd_mdrun = f"exec {settings.cmd_mpi} {settings.cmd_serial} \
-                -deffnm {dir}/prd 1> {dir}/mdrun.log 2>&1"  # NOQA: E221
-
-        # Depending on the supercomputer environment, MPI-related hangs may occur in rare cases.
-        # To solve this problem, restart mdrun until log is output
-        # This is a useless calculation, but it is better than a hang.
-        run_flag = False
-        for _ in range(20):
-            if Path(f"{dir}/prd.log").exists():
-                subprocess.run(f"rm {dir}/prd.log", shell=True)
-                module_time.sleep(1)
-            process = subprocess.Popen(cmd_mdrun, shell=True)
-            module_time.sleep(10)
-            if Path(f"{dir}/prd.log").exists():
-                run_flag = True
-                break
-            else:
-                process.kill()
-                module_time.sleep(5)
-        if not run_flag:
-            LOGGER.error("mdrun did not start due to some technical errors")
-            exit(1)
-        process.wait()
-        if process.returncode != 0:
-            LOGGER.error("error occurred at mdrun command")
-            LOGGER.error(f"see {dir}/mdrun.log and {dir}/prd.log")
-            exit(1)
+        cmd_mdrun = f"{settings.cmd_mpi} {settings.cmd_serial} \
+                -deffnm {dir}/prd"  # NOQA: E221
+        if settings.checkpoint_resume:
+            cmd_mdrun += f" -cpi {dir}/prd.cpt"
+        grompp = []
+        if self.has_checkpoint(settings, dir):
+            LOGGER.info(f"MD in {dir} resumes from prd.cpt")
+        else:
+            grompp = self.grompp_commands(settings, dir)
+        return [
+            *grompp,
+            self.mdrun_command(
+                settings,
+                cmd_mdrun,
+                [dir],
+                log=f"{dir}/mdrun.log",
+                errors=[
+                    "error occurred at mdrun command",
+                    f"see {dir}/mdrun.log and {dir}/prd.log",
+                ],
+            ),
+        ]
+
+    def has_checkpoint(self, settings: MDsettings, dir: str) -> bool:
+        """
+        whether the MD in dir was interrupted after writing a checkpoint.
+        mdrun then continues it with -cpi, appending to the existing output,
+        instead of rerunning it from input.gro
+        """
+        return (
+            settings.checkpoint_resume
+            and Path(f"{dir}/prd.cpt").exists()
+            and Path(f"{dir}/prd.tpr").exists()
+        )
 
-    def run_grompp(self, settings: MDsettings, dir: str) -> None:
-        cmd_grompp = f"exec {settings.cmd_gmx} grompp \
+    def grompp_commands(self, settings: MDsettings, dir: str) -> List[Command]:
+        """
+        The preprocessed topology (grompp -pp) does not depend on the replica,
+        so it is written once per trial and reused for the following grompp,
+        which then skips the preprocessing of the include files.
+        The cache is keyed on the content of mdconf, index_file, topology and
+        the files it includes (also those found in GMXLIB or the share
+        directory of gmx), GMXLIB and the output of gmx --version.
+        """
+        topology = settings.topology
+        cache = None
+        if settings.grompp_cache:
+            cache = Path(
+                f"{settings.each_trial()}/grompp_cache/"
+                f"processed_{self.grompp_inputs_hash(settings)}.top"
+            )
+            if cache.exists():
+                topology = cache
+
+        cmd_grompp = f"{settings.cmd_gmx} grompp \
                     -f {settings.mdconf} \
                     -o {dir}/prd.tpr \
-                    -p {settings.topology} \
+                    -p {topology} \
                     -c {dir}/input.gro \
                     -n {settings.index_file} \
                     -po {dir}/mdout.mdp \
-                    -maxwarn 10 1> {dir}/grompp.log 2>&1"  # NOQA: E221
-        res_grompp = subprocess.run(cmd_grompp, shell=True)
-        if res_grompp.returncode != 0:
-            LOGGER.error("error occurred at grompp command")
-            LOGGER.error(f"see {dir}/grompp.log")
-            exit(1)
+                    -maxwarn 10"  # NOQA: E221
+        if cache is None or cache.exists():
+            return [
+                Command(
+                    cmd=cmd_grompp,
+                    log=f"{dir}/grompp.log",
+                    errors=[
+                        "error occurred at grompp command",
+                        f"see {dir}/grompp.log",
+                    ],
+                )
+            ]
+
+        processed = f"{dir}/processed.top"
+
+        def store_cache() -> None:
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            # replace atomically, grompp of other replicas may do the same
+            os.replace(processed, cache)
+
+        return [
+            Command(
+                cmd=f"{cmd_grompp} -pp {processed}",
+                log=f"{dir}/grompp.log",
+                errors=["error occurred at grompp command", f"see {dir}/grompp.log"],
+            ),
+            Command(func=store_cache),
+        ]
+
+    def grompp_inputs_hash(self, settings: MDsettings) -> str:
+        version = gmx_version(settings.cmd_gmx)
+        gmxlib = os.environ.get("GMXLIB", "")
+        digest = hashlib.sha256()
+        digest.update(version.encode())
+        digest.update(gmxlib.encode())
+        # include directories searched by grompp after the including file
+        include_dirs = [Path(dir) for dir in gmxlib.split(os.pathsep) if dir != ""]
+        match = DATA_PREFIX.search(version)
+        if match:
+            include_dirs.append(Path(match.group(1)) / "share" / "gromacs" / "top")
+        files = [Path(settings.mdconf), Path(settings.index_file)]
+        files += self.topology_files(Path(settings.topology), include_dirs)
+        for file in files:
+            digest.update(str(file).encode())
+            digest.update(file.read_bytes())
+        return digest.hexdigest()[:16]
+
+    def topology_files(self, topology: Path, include_dirs: List[Path]) -> List[Path]:
+        """
+        topology and the files it includes. an include is looked up relative to
+        the including file first and then in include_dirs, as grompp does
+        """
+        files: List[Path] = []
+        stack = [topology]
+        while len(stack) > 0:
+            file = stack.pop()
+            if file in files or not file.is_file():
+                continue
+            files.append(file)
+            with open(file, "r", errors="ignore") as f:
+                for line in f:
+                    match = INCLUDE.match(line)
+                    if match:
+                        for dir in [file.parent] + include_dirs:
+                            if (dir / match.group(1)).is_file():
+                                stack.append(dir / match.group(1))
+                                break
+        return files
+
+    def mdrun_command(
+        self,
+        settings: MDsettings,
+        cmd_mdrun: str,
+        dirs: List[str],
+        log: str,
+        errors: List[str],
+    ) -> Command:
+        """
+        Depending on the supercomputer environment, MPI-related hangs may occur in
+        rare cases. mdrun is regarded as alive as soon as prd.log appears in every
+        directory, and as hung if it does not start within mdrun_startup_timeout
+        or if neither prd.log nor the trajectory grows for mdrun_stall_timeout.
+        A hung mdrun is killed and relaunched up to mdrun_max_retry times,
+        from its last checkpoint if checkpoint_resume is true.
+        """
+        logs = [f"{dir}/prd.log" for dir in dirs]
+        trajectories = [f"{dir}/prd{settings.trajectory_extension}" for dir in dirs]
+        return Command(
+            cmd=cmd_mdrun,
+            log=log,
+            errors=errors,
+            startup_files=logs,
+            watch_files=logs + trajectories,
+            startup_timeout=settings.mdrun_startup_timeout,
+            stall_timeout=settings.mdrun_stall_timeout,
+            max_retry=settings.mdrun_max_retry,
+        )
 
     def run_MPI(
         self, settings: MDsettings, cycle: int, groupreplica: List[int]
@@ -66,50 +204,39 @@ class GROMACS(SuperSimulator):
             for replica in groupreplica
         ]
 
-        processes = []
+        engine = get_engine(settings)
+        jobs = []
         for dir in groupdir:
-            p = mp.Process(target=self.run_grompp, args=(settings, dir))
-            p.start()
-            processes.append(p)
-        for p in processes:
-            p.join()
-        for p in processes:
-            if p.exitcode != 0:
-                LOGGER.error("error occurred at child process")
+            if self.has_checkpoint(settings, dir):
+                LOGGER.info(f"MD in {dir} resumes from prd.cpt")
+                continue
+            jobs.append(engine.submit(self.grompp_commands(settings, dir)))
+        for job in jobs:
+            job.join()
+        for job in jobs:
+            if job.exitcode != 0:
                 exit(1)
-        for p in processes:
-            p.close()
+        for job in jobs:
+            job.close()
 
+        dir = groupdir[-1]
         groupdirtxt = " ".join(groupdir)
-        cmd_mdrun = f"exec {settings.cmd_mpi} {settings.cmd_parallel} \
+        cmd_mpi = self.cmd_mpi_for(settings, len(groupreplica))
+        cmd_mdrun = f"{cmd_mpi} {settings.cmd_parallel} \
                 -multidir {groupdirtxt} \
-                -deffnm prd \
-                1> {dir}/mdrun.log 2>&1"  # NOQA: E221
-
-        # Depending on the supercomputer environment, MPI-related hangs may occur in rare cases.
-        # To solve this problem, restart mdrun until log is output
-        # This is a useless calculation, but it is better than a hang.
-        run_flag = False
-        for _ in range(20):
-            if Path(f"{groupdir[0]}/prd.log").exists():
-                for dir in groupdir:
-                    subprocess.run(f"rm {dir}/prd.log", shell=True)
-                    module_time.sleep(1)
-            process = subprocess.Popen(cmd_mdrun, shell=True)
-            module_time.sleep(10)
-            if Path(f"{groupdir[0]}/prd.log").exists():
-                run_flag = True
-                break
-            else:
-                process.kill()
-                module_time.sleep(5)
-        if not run_flag:
-            LOGGER.error("mdrun did not start due to some technical error")
-            exit(1)
-        process.wait()
-        if process.returncode != 0:
-            LOGGER.error("error occurred at mdrun command")
-            LOGGER.error(
-                f"see mdrun.log and prd.log in each replicas in cycle{cycle:03}"
-            )
+                -deffnm prd"  # NOQA: E221
+        if settings.checkpoint_resume:
+            # relative to each directory of -multidir
+            cmd_mdrun += " -cpi prd.cpt"
+        command = self.mdrun_command(
+            settings,
+            cmd_mdrun,
+            groupdir,
+            log=f"{dir}/mdrun.log",
+            errors=[
+                "error occurred at mdrun command",
+                f"see mdrun.log and prd.log in each replicas in cycle{cycle:03}",
+            ],
+        )
+        if engine.run([command]) != 0:
             exit(1)
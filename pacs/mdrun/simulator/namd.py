@@ -1,31 +1,76 @@
-import subprocess
+import shutil
+from pathlib import Path
 from typing import List
 
 from pacs.mdrun.simulator.superSimulator import SuperSimulator
 from pacs.models.settings import MDsettings
+from pacs.utils.engine import Command, get_engine
 from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
 
 
 class NAMD(SuperSimulator):
-    def run_md(self, settings: MDsettings, cycle: int, replica: int) -> None:
+    def md_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
         dir = settings.each_replica(_cycle=cycle, _replica=replica)
-        cmd_cp = f"cat {settings.mdconf} > {dir}/prd.conf"
-        res_cp = subprocess.run(cmd_cp, shell=True)
-        if res_cp.returncode != 0:
-            LOGGER.error("error occurred at cp command")
-            exit(1)
 
-        cmd_run = f"{settings.cmd_mpi} {settings.cmd_serial} \
-                {dir}/prd.conf 1> {dir}/prd.log 2>&1"
-        res_run = subprocess.run(cmd_run, shell=True)
-        if res_run.returncode != 0:
-            LOGGER.error("error occurred at run command")
-            LOGGER.error(f"see {dir}/prd.log")
-            exit(1)
+        def copy_conf() -> None:
+            shutil.copyfile(settings.mdconf, f"{dir}/prd.conf")
+
+        cmd_run = f"{settings.cmd_mpi} {settings.cmd_serial} {dir}/prd.conf"
+        return [
+            Command(func=copy_conf),
+            Command(
+                cmd=cmd_run,
+                log=f"{dir}/prd.log",
+                errors=["error occurred at run command", f"see {dir}/prd.log"],
+            ),
+        ]
 
     def run_MPI(
         self, settings: MDsettings, cycle: int, groupreplica: List[int]
     ) -> None:
-        pass
+        """
+        run the replicas of a group as a single multi-copy (+replicas) launch.
+        each copy moves to its own replica directory and reads prd.conf there,
+        as namd2 does with the config file given on the command line
+        """
+        groupdir = [
+            Path(settings.each_replica(_cycle=cycle, _replica=replica)).resolve()
+            for replica in groupreplica
+        ]
+        for dir in groupdir:
+            shutil.copyfile(settings.mdconf, f"{dir}/prd.conf")
+
+        dir = groupdir[0]
+        dirs_tcl = " ".join(f"{{{dir}}}" for dir in groupdir)
+        with open(f"{dir}/multicopy.conf", "w") as f:
+            f.write(f"set replica_dirs [list {dirs_tcl}]\n")
+            f.write("cd [lindex $replica_dirs [myReplica]]\n")
+            f.write("source prd.conf\n")
+
+        def move_logs() -> None:
+            # the output of copy i is written to multicopy.i.log by +stdout
+            for i, replica_dir in enumerate(groupdir):
+                shutil.move(f"{dir}/multicopy.{i}.log", f"{replica_dir}/prd.log")
+
+        cmd_mpi = self.cmd_mpi_for(settings, len(groupreplica))
+        cmd_run = f"{cmd_mpi} {settings.cmd_parallel} \
+                +replicas {len(groupreplica)} \
+                {dir}/multicopy.conf \
+                +stdout {dir}/multicopy.%d.log"  # NOQA: E221
+        commands = [
+            Command(
+                cmd=cmd_run,
+                log=f"{dir}/multicopy.log",
+                errors=[
+                    "error occurred at run command",
+                    f"see {dir}/multicopy.log and multicopy.*.log",
+                ],
+            ),
+            Command(func=move_logs),
+        ]
+        if get_engine(settings).run(commands) != 0:
+            exit(1)
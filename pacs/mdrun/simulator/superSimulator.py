@@ -1,107 +1,198 @@
 import dataclasses
-import multiprocessing as mp
 import re
+import time
 from abc import ABCMeta, abstractmethod
-from typing import List
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Tuple
 
+import pacs.utils.state as state
 from pacs.models.settings import MDsettings
-from pacs.utils.logger import close_logger, generate_logger
+from pacs.utils.engine import Command, Job, get_engine
+from pacs.utils.logger import generate_logger
+from pacs.utils.slots import SlotPool
 
 LOGGER = generate_logger(__name__)
 
+# option giving the number of MPI processes (mpirun -np 20, srun -n 20, ...)
+MPI_RANK_OPTION = re.compile(r"(?<!\S)(-np|-n|--np|--ntasks)(\s+|=)(\d+)(?!\S)")
+
 
 @dataclasses.dataclass
 class SuperSimulator(metaclass=ABCMeta):
+    # replica slots shared with the other trials (see pacs_md_trials)
+    slots: SlotPool = None
+
     @abstractmethod
-    def run_md(self, settings: MDsettings, cycle: int, replica: int) -> None:
+    def md_commands(
+        self, settings: MDsettings, cycle: int, replica: int
+    ) -> List[Command]:
         pass
 
+    def start_md(self, settings: MDsettings, cycle: int, replica: int) -> Job:
+        """
+        start the MD of a replica on the command engine and return immediately
+        """
+        return get_engine(settings).submit(self.md_commands(settings, cycle, replica))
+
+    def run_md(self, settings: MDsettings, cycle: int, replica: int) -> None:
+        job = self.start_md(settings, cycle, replica)
+        job.join()
+        if job.exitcode != 0:
+            exit(1)
+        job.close()
+
     @abstractmethod
     def run_MPI(
         self, settings: MDsettings, cycle: int, groupreplica: List[int]
     ) -> None:
         pass
 
-    def run_parallel(self, settings: MDsettings, cycle: int) -> None:
+    def run_parallel(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        on_finished: Callable[[int], None] = None,
+        gate=None,
+    ) -> None:
+        """
+        on_finished is called with the replica number every time the MD of
+        a replica has finished, e.g. to start its analysis right away.
+        gate tells whether the input structure of a replica is ready when it is
+        still being exported in the background (see Cycle.ExportGate).
+        """
         if settings.n_parallel == 1 or cycle == 0:
-            self.run_serial(settings, cycle)
+            self.run_serial(settings, cycle, on_finished, gate)
             return
 
         if settings.cmd_mpi != "":
-            if settings.simulator == "gromacs" or settings.simulator == "amber":
-                self.run_parallel_MPI(settings, cycle)
+            if settings.simulator in ["gromacs", "amber", "namd"]:
+                self.run_parallel_MPI(settings, cycle, on_finished, gate)
                 return
 
         not_finished_replicas = self.not_finished_replicas(settings, cycle)
         if len(not_finished_replicas) == 0:
             return
 
-        n_parallel = settings.n_parallel
-        rest = len(not_finished_replicas)
-        n_loop = (rest + n_parallel - 1) // n_parallel
-        for i in range(n_loop):
-            processes = []
-            for replica in not_finished_replicas[
-                i * n_parallel : min((i + 1) * n_parallel, rest)
-            ]:
-                process = mp.Process(
-                    target=self.run_md, args=(settings, cycle, replica)
-                )
-                processes.append(process)
-                process.start()
-
-            for process in processes:
-                process.join()
-
-            for process in processes:
-                if process.exitcode != 0:
-                    LOGGER.error("error occurred at child process")
+        # Rolling window: start the next pending replica as soon as any slot frees up
+        # instead of waiting for the slowest replica of a fixed batch.
+        pending = deque(not_finished_replicas)
+        running: Dict[int, Tuple[Job, int, float]] = {}
+        while len(pending) > 0 or len(running) > 0:
+            if gate is not None:
+                gate.update(block=False)
+            waiting_slot = False
+            for replica in list(pending):
+                if len(running) >= settings.n_parallel:
+                    break
+                if gate is not None and not gate.is_ready(replica):
+                    continue
+                if self.slots is not None and not self.slots.acquire(block=False):
+                    # all slots are used by the other trials
+                    waiting_slot = True
+                    break
+                pending.remove(replica)
+                started = time.time()
+                job = self.start_md(settings, cycle, replica)
+                running[job.sentinel] = (job, replica, started)
+
+            waitables = list(running.keys())
+            if gate is not None:
+                waitables += gate.waitables()
+            if waiting_slot:
+                waitables.append(self.slots.fileno())
+            for sentinel in wait(waitables):
+                if sentinel not in running:
+                    # an input structure has been exported or a slot is freed
+                    continue
+                job, replica, started = running.pop(sentinel)
+                job.join()
+                if job.exitcode != 0:
+                    LOGGER.error(f"error occurred at MD of replica{replica:03}")
+                    for other, _, _ in running.values():
+                        other.terminate()
                     exit(1)
-
-            for process in processes:
-                process.close()
-
-            for replica in not_finished_replicas[
-                i * n_parallel : min((i + 1) * n_parallel, rest)
-            ]:
-                self.record_finished(settings, cycle, replica)
-
-    def run_serial(self, settings: MDsettings, cycle: int) -> None:
+                job.close()
+                self.release_slots(1)
+                self.record_finished(settings, cycle, replica, on_finished, started)
+
+    def run_serial(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        on_finished: Callable[[int], None] = None,
+        gate=None,
+    ) -> None:
         not_finished_replicas = self.not_finished_replicas(settings, cycle)
         if len(not_finished_replicas) == 0:
             return
         for replica in not_finished_replicas:
+            self.wait_ready(gate, [replica])
+            self.acquire_slots(1)
+            started = time.time()
             self.run_md(settings, cycle, replica)
-            self.record_finished(settings, cycle, replica)
+            self.release_slots(1)
+            self.record_finished(settings, cycle, replica, on_finished, started)
 
-    def not_finished_replicas(self, settings: MDsettings, cycle: int) -> List[int]:
-        finished_replicas = [False] * settings.n_replica
-        dir = settings.each_cycle(_cycle=cycle)
-        with open(f"{dir}/summary/progress.log", "r") as f:
-            for line in f:
-                if "replica" not in line:
-                    continue
-                replica = int(re.findall(r"\d+", line)[-1])
-                finished_replicas[replica - 1] = True
+    def acquire_slots(self, n: int) -> None:
+        if self.slots is not None:
+            self.slots.acquire_many(n)
+
+    def release_slots(self, n: int) -> None:
+        if self.slots is not None:
+            self.slots.release(n)
 
+    def wait_ready(self, gate, replicas: List[int]) -> None:
+        if gate is None:
+            return
+        gate.update(block=False)
+        while not all(gate.is_ready(replica) for replica in replicas):
+            gate.update(block=True)
+
+    def not_finished_replicas(self, settings: MDsettings, cycle: int) -> List[int]:
+        finished_replicas = state.finished_replicas(settings, cycle)
         not_finished_replicas = [
-            i + 1 for i, finished in enumerate(finished_replicas) if not finished
+            replica
+            for replica in range(1, settings.n_replica + 1)
+            if replica not in finished_replicas
         ]
         return not_finished_replicas
 
-    def record_finished(self, settings: MDsettings, cycle: int, replica: int) -> None:
-        dir = settings.each_cycle(_cycle=cycle)
-        logger = generate_logger(f"c{cycle}rep{replica}", f"{dir}/summary/progress.log")
-        logger.info(f"replica{replica:03} done")
-        close_logger(logger)
-
-    def run_parallel_MPI(self, settings: MDsettings, cycle: int) -> None:
+    def record_finished(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        replica: int,
+        on_finished: Callable[[int], None] = None,
+        started: float = None,
+    ) -> None:
+        state.record(settings, cycle, "md", replica, started)
+        state.record_trajectory(
+            settings, cycle, replica, f"prd{settings.trajectory_extension}"
+        )
+        LOGGER.info(f"replica{replica:03} done")
+        if on_finished is not None:
+            on_finished(replica)
+
+    def run_parallel_MPI(
+        self,
+        settings: MDsettings,
+        cycle: int,
+        on_finished: Callable[[int], None] = None,
+        gate=None,
+    ) -> None:
         not_finished_replicas = self.not_finished_replicas(settings, cycle)
         if len(not_finished_replicas) == 0:
             return
         if len(not_finished_replicas) == 1:
+            self.wait_ready(gate, not_finished_replicas)
+            self.acquire_slots(1)
+            started = time.time()
             self.run_md(settings, cycle, not_finished_replicas[0])
-            self.record_finished(settings, cycle, not_finished_replicas[0])
+            self.release_slots(1)
+            self.record_finished(
+                settings, cycle, not_finished_replicas[0], on_finished, started
+            )
             return
 
         n_parallel = settings.n_parallel
@@ -113,9 +204,50 @@ class SuperSimulator(metaclass=ABCMeta):
                 i * n_parallel : min((i + 1) * n_parallel, rest)
             ]:
                 groupreplica.append(replica)
-            if len(groupreplica) != n_parallel:
-                self.run_serial(settings, cycle)
+            if len(groupreplica) != n_parallel and (
+                len(groupreplica) == 1
+                or self.cmd_mpi_for(settings, len(groupreplica)) is None
+            ):
+                self.run_serial(settings, cycle, on_finished, gate)
             else:
+                self.wait_ready(gate, groupreplica)
+                self.acquire_slots(len(groupreplica))
+                started = time.time()
                 self.run_MPI(settings, cycle, groupreplica)
+                self.release_slots(len(groupreplica))
                 for replica in groupreplica:
-                    self.record_finished(settings, cycle, replica)
+                    self.record_finished(settings, cycle, replica, on_finished, started)
+
+    def cmd_mpi_for(self, settings: MDsettings, n_group: int) -> str:
+        """
+        cmd_mpi for a group of n_group replicas.
+
+        For the last group smaller than n_parallel, the number of MPI processes
+        in cmd_mpi is kept if it can be divided among n_group replicas.
+        Otherwise it is reduced to the number of processes per replica times
+        n_group. None is returned if the number of processes is not found.
+        """
+        if n_group == settings.n_parallel:
+            return settings.cmd_mpi
+        match = MPI_RANK_OPTION.search(settings.cmd_mpi)
+        if match is None:
+            LOGGER.warning(
+                f"the number of MPI processes is not found in '{settings.cmd_mpi}'."
+                f" the remaining {n_group} replicas are run in series"
+            )
+            return None
+        n_rank = int(match.group(3))
+        if n_rank % n_group != 0:
+            if n_rank % settings.n_parallel != 0:
+                LOGGER.warning(
+                    f"{n_rank} MPI processes cannot be divided among "
+                    f"{settings.n_parallel} replicas. "
+                    f"the remaining {n_group} replicas are run in series"
+                )
+                return None
+            n_rank = n_rank // settings.n_parallel * n_group
+        return (
+            settings.cmd_mpi[: match.start(3)]
+            + str(n_rank)
+            + settings.cmd_mpi[match.end(3) :]
+        )
@@ -1,7 +1,9 @@
 import dataclasses
 import re
 from pathlib import Path
+from typing import List
 
+import numpy as np
 from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
@@ -15,12 +17,19 @@ class MDsettings:
 
     Attributes:
         trial (int): id of trial
+        trials (List[int]): ids of the trials run concurrently in one pacs mdrun
         max_cycle (int): maximum number of cycles
         n_replica (int): number of replicas
         n_parallel (int): number of replicas which are calculated at same time
         centering (bool): whether to center the structure or not in export
         centering_selection (str): selection for centering
         working_dir (Path): working directory
+        pipeline (bool): whether to overlap the analysis and export of each
+            replica with the MD of the other replicas
+        max_concurrent_commands (int): maximum number of external commands
+            run at the same time by the command engine
+        command_timeout (float): seconds after which an analysis or export
+            command is killed (0 disables the timeout)
         simulator (str): simulator for MD simulation(gromacs, namd, amber)
         structure (Path): structure file
         topology (Path): topology file
@@ -34,22 +43,40 @@ class MDsettings:
         type (str): evaluation type
         threshold (float): threshold for evaluation type
         skip_frame (int): number of frames to skip
+        start_frame (int): first frame of each trajectory to be analyzed
+        chunk_size (int): number of frames read at once by mdtraj (0: all)
+        analysis_memory (float): memory (GB) for the concurrent CV calculations
+            by mdtraj, which determines chunk_size and their number (0: no limit)
+        cv_log (bool): whether to export cv.npy and cv_ranked.npy as text logs
+        cmd_cpptraj (str): cpptraj command of the analyzer (e.g. cpptraj.MPI with
+            mpirun), which is run once per cycle for all replicas
         reference (Path): reference file
         selection1 (str): selection for evaluation type
         selection2 (str): selection for evaluation type
         selection3 (str): selection for evaluation type
         selection4 (str): selection for evaluation type
         nojump (bool): whether to execute nojump treatment (valid only for gmx)
+        grompp_cache (bool): whether to reuse the preprocessed topology of grompp
+        mdrun_startup_timeout (float): seconds to wait for mdrun to write its log
+        mdrun_stall_timeout (float): seconds without log/trajectory growth
+            before mdrun is regarded as hung (0 disables the check)
+        mdrun_max_retry (int): number of times mdrun is relaunched
+        checkpoint_resume (bool): whether an interrupted replica continues
+            from its checkpoint (valid only for gmx)
     """
 
     # basic
     trial: int = 1
+    trials: List[int] = None
     max_cycle: int = 1
     n_replica: int = 1
     n_parallel: int = 1
     centering: bool = True
     centering_selection: str = None
     working_dir: Path = Path("./.")
+    pipeline: bool = False
+    max_concurrent_commands: int = 256
+    command_timeout: float = 0.0
 
     # simulator
     simulator: str = None
@@ -67,6 +94,11 @@ class MDsettings:
     type: str = None
     threshold: float = None
     skip_frame: int = 1
+    start_frame: int = 0
+    chunk_size: int = 0
+    analysis_memory: float = 0.0
+    cv_log: bool = True
+    cmd_cpptraj: str = "cpptraj"
     reference: Path = None
     selection1: str = None
     selection2: str = None
@@ -91,6 +123,17 @@ class MDsettings:
     # nojump option
     nojump: bool = False
 
+    # grompp option
+    grompp_cache: bool = True
+
+    # mdrun watchdog option
+    mdrun_startup_timeout: float = 60.0
+    mdrun_stall_timeout: float = 0.0
+    mdrun_max_retry: int = 20
+
+    # resume option
+    checkpoint_resume: bool = True
+
     def each_replica(
         self, _trial: int = None, _cycle: int = None, _replica: int = None
     ) -> str:
@@ -119,6 +162,9 @@ class MDsettings:
     def log_file(self) -> str:
         return f"{self.working_dir}/trial{self.trial:03}.log"
 
+    def cache_dir(self) -> str:
+        return f"{self.each_trial()}/cache"
+
     def rmmol_top(self) -> None:
         c0r1_dir = self.each_replica(_cycle=0, _replica=1)
         self.top_mdtraj = f"{c0r1_dir}/rmmol_top.pdb"
@@ -156,11 +202,22 @@ class MDsettings:
         self.n_replica = int(self.n_replica)
         self.n_parallel = int(self.n_parallel)
         self.skip_frame = int(self.skip_frame)
+        self.start_frame = int(self.start_frame)
+        self.chunk_size = int(self.chunk_size)
+        self.analysis_memory = float(self.analysis_memory)
+        self.max_concurrent_commands = int(self.max_concurrent_commands)
+        self.command_timeout = float(self.command_timeout)
+        self.mdrun_startup_timeout = float(self.mdrun_startup_timeout)
+        self.mdrun_stall_timeout = float(self.mdrun_stall_timeout)
+        self.mdrun_max_retry = int(self.mdrun_max_retry)
         if self.threshold is not None:
             self.threshold = float(self.threshold)
-        if self.trial < 0 or self.trial > 999:
-            LOGGER.error(f"trial number {self.trial} is out of range 1..999")
-            exit(1)
+        if self.trials is None:
+            self.trials = [self.trial]
+        for trial in self.trials:
+            if trial < 0 or trial > 999:
+                LOGGER.error(f"trial number {trial} is out of range 1..999")
+                exit(1)
         if self.max_cycle < 0 or self.max_cycle > 999:
             LOGGER.error(f"cycle number {self.max_cycle} is out of range 1..999")
             exit(1)
@@ -170,9 +227,28 @@ class MDsettings:
         if self.n_parallel < 0 or self.n_parallel > 999:
             LOGGER.error(f"n_parallel number {self.replica} is out of range 1..999")
             exit(1)
+        if self.skip_frame < 1:
+            LOGGER.error("skip_frame must be a positive integer")
+            exit(1)
+        if self.start_frame < 0:
+            LOGGER.error("start_frame must be a non-negative integer")
+            exit(1)
+        if self.chunk_size < 0:
+            LOGGER.error("chunk_size must be a non-negative integer")
+            exit(1)
+        if self.analysis_memory < 0:
+            LOGGER.error("analysis_memory must be non-negative")
+            exit(1)
+        if self.max_concurrent_commands < 1:
+            LOGGER.error("max_concurrent_commands must be a positive integer")
+            exit(1)
 
         # bool
         self.centering = self.check_bool(self.centering)
+        self.pipeline = self.check_bool(self.pipeline)
+        self.grompp_cache = self.check_bool(self.grompp_cache)
+        self.cv_log = self.check_bool(self.cv_log)
+        self.checkpoint_resume = self.check_bool(self.checkpoint_resume)
         self.rmmol = self.check_bool(self.rmmol)
         # self.genrepresent = self.check_bool(self.genrepresent)
         self.rmfile = self.check_bool(self.rmfile)
@@ -407,3 +483,110 @@ class Snapshot:
 
     def __lt__(self, other) -> bool:
         return self.cv < other.cv
+
+
+class Snapshots:
+
+    """
+    snapshots of the trajectories of a cycle stored in a structured array,
+    so that no python object is made for each frame
+
+    Attributes:
+        table (np.ndarray): structured array with the fields replica, frame and
+            cv (a scalar or a vector of the dtype of the CVs for each frame)
+    """
+
+    def __init__(self, table) -> None:
+        self.table = table
+
+    @classmethod
+    def from_arrays(cls, replica, frame, cv) -> "Snapshots":
+        cv = np.asarray(cv)
+        table = np.empty(
+            len(cv),
+            dtype=[
+                ("replica", np.int32),
+                ("frame", np.int32),
+                ("cv", cv.dtype, cv.shape[1:]),
+            ],
+        )
+        table["replica"] = replica
+        table["frame"] = frame
+        table["cv"] = cv
+        return cls(table)
+
+    @classmethod
+    def from_list(cls, snapshots: List[Snapshot]) -> "Snapshots":
+        return cls.from_arrays(
+            [snapshot.replica for snapshot in snapshots],
+            [snapshot.frame for snapshot in snapshots],
+            [snapshot.cv for snapshot in snapshots],
+        )
+
+    @property
+    def replica(self):
+        return self.table["replica"]
+
+    @property
+    def frame(self):
+        return self.table["frame"]
+
+    @property
+    def cv(self):
+        return self.table["cv"]
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, index):
+        """
+        Snapshot for an integer index, Snapshots for a slice or an index array
+        """
+        if isinstance(index, (slice, list)) or getattr(index, "ndim", 0) > 0:
+            return Snapshots(self.table[index])
+        row = self.table[index]
+        return Snapshot(int(row["replica"]), int(row["frame"]), row["cv"])
+
+    def __iter__(self):
+        for index in range(len(self.table)):
+            yield self[index]
+
+    def top(self, k: int, reverse: bool = False) -> "Snapshots":
+        """
+        the k snapshots with the smallest (largest if reverse) scalar CVs in order.
+        only these k are sorted after a partial selection (O(n + k log k)),
+        and ties are broken by the position as in sorted().
+        NaN CVs are ranked last in either order
+        """
+        key = -self.cv if reverse else self.cv
+        k = min(k, len(key))
+        if np.issubdtype(key.dtype, np.floating):
+            nan = np.isnan(key)
+        else:
+            nan = np.zeros(len(key), dtype=bool)
+        if nan.any():
+            LOGGER.warning(f"{nan.sum()} snapshots whose CV is NaN are ranked last")
+        valid = np.flatnonzero(~nan)
+        n_valid = min(k, len(valid))
+        selected = valid[:0]
+        if n_valid > 0:
+            kth = np.partition(key[valid], n_valid - 1)[n_valid - 1]
+            less = valid[key[valid] < kth]
+            equal = valid[key[valid] == kth][: n_valid - len(less)]
+            selected = np.concatenate([less, equal])
+            selected = selected[np.lexsort((selected, key[selected]))]
+        selected = np.concatenate([selected, np.flatnonzero(nan)[: k - n_valid]])
+        return Snapshots(self.table[selected])
+
+    def lines(self) -> List[str]:
+        """
+        str() of each snapshot
+        """
+        # scalar CVs are formatted as python floats, as Snapshot.__str__ does
+        cvs = self.cv.tolist() if self.cv.ndim == 1 else self.cv
+        return [
+            f"replica {replica} frame {frame} cv {cv}"
+            for replica, frame, cv in zip(
+                self.replica.tolist(), self.frame.tolist(), cvs
+            )
+        ]
@@ -0,0 +1,66 @@
+from typing import List, Union
+
+import numpy as np
+from pacs.utils.logger import generate_logger
+
+LOGGER = generate_logger(__name__)
+
+
+class COMEngine:
+    """
+    centers of mass of atom selections, computed without atom_slice copies
+
+    The mass weights of each selection are computed once, over the range of
+    atoms spanned by the selection. The centers of mass of all frames are then
+    given by a single contraction of the weights with that range of the
+    coordinate array, which is a view and not a copy.
+
+    @param
+    topology:md.Topology topology of the trajectory
+    selections:List[str] mdtraj selections or atom indices
+    """
+
+    def __init__(self, topology, selections: List[Union[str, np.ndarray]]) -> None:
+        self.spans: List[slice] = []
+        self.weights: List[np.ndarray] = []
+        for selection in selections:
+            if isinstance(selection, str):
+                index = topology.select(selection)
+            else:
+                index = np.asarray(selection)
+            if len(index) == 0:
+                LOGGER.error(f"no atom is selected by '{selection}'")
+                exit(1)
+            start, stop = int(index.min()), int(index.max()) + 1
+            weight = np.zeros(stop - start, dtype=np.float64)
+            weight[index - start] = [topology.atom(i).element.mass for i in index]
+            self.spans.append(slice(start, stop))
+            self.weights.append(weight / weight.sum())
+
+    def compute(self, xyz: np.ndarray) -> np.ndarray:
+        """
+        xyz:(n_frames, n_atoms, 3) -> centers of mass (n_frames, n_selections, 3)
+        """
+        com = np.empty((len(xyz), len(self.spans), 3), dtype=np.float64)
+        for i, (span, weight) in enumerate(zip(self.spans, self.weights)):
+            # the float32 coordinates are cast to float64 in buffered chunks
+            com[:, i, :] = np.einsum(
+                "a,fak->fk", weight, xyz[:, span, :], dtype=np.float64
+            )
+        return com
+
+    def distance(self, xyz: np.ndarray) -> np.ndarray:
+        """
+        distance between the centers of mass of the first two selections
+        """
+        com = self.compute(xyz)
+        return np.linalg.norm(com[:, 0, :] - com[:, 1, :], axis=1)
+
+
+def com_distance(
+    trj, selection1: Union[str, np.ndarray], selection2: Union[str, np.ndarray]
+) -> np.ndarray:
+    """
+    inter-COM distance of selection1 and selection2 in each frame of trj
+    """
+    return COMEngine(trj.topology, [selection1, selection2]).distance(trj.xyz)
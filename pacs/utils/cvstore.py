@@ -0,0 +1,103 @@
+"""
+store of the CVs of a cycle in trialNNN/cycleNNN/summary
+
+cv.npy (every analyzed frame) and cv_ranked.npy (the ranked snapshots) hold the
+structured array of Snapshots (replica, frame and cv of each snapshot). They are
+the source of truth read by the resumed analyzer, the exporters, genrepresent
+and the manifest, and are memory-mapped instead of being parsed.
+cv.log and cv_ranked.log are their human-readable exports (settings.cv_log).
+The text logs are still read for the cycles analyzed by older versions.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+from pacs.models.settings import MDsettings, Snapshot, Snapshots
+from pacs.utils.logger import generate_logger
+
+LOGGER = generate_logger(__name__)
+
+PATTERN_VECTOR = re.compile(r"replica (\d+) frame (\d+) cv \[([-\d.\se+]+)\]")
+PATTERN_SCALAR = re.compile(r"replica (\d+) frame (\d+) cv ([-\d.e+]+)")
+
+
+def cv_file(settings: MDsettings, cycle: int, name: str, ext: str = ".npy") -> Path:
+    """
+    name: cv or cv_ranked
+    """
+    return Path(f"{settings.each_cycle(_cycle=cycle)}/summary/{name}{ext}")
+
+
+def exists(settings: MDsettings, cycle: int, name: str) -> bool:
+    return (
+        cv_file(settings, cycle, name).exists()
+        or cv_file(settings, cycle, name, ".log").exists()
+    )
+
+
+def write(
+    settings: MDsettings,
+    cycle: int,
+    name: str,
+    snapshots: Union[Snapshots, List[Snapshot]],
+) -> None:
+    if not isinstance(snapshots, Snapshots):
+        snapshots = Snapshots.from_list(snapshots)
+    path = cv_file(settings, cycle, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # replace atomically, an interrupted run must not leave a truncated store
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp, snapshots.table)
+    os.replace(tmp, path)
+    if settings.cv_log:
+        with open(cv_file(settings, cycle, name, ".log"), "w") as f:
+            f.write("".join(line + "\n" for line in snapshots.lines()))
+
+
+def read(settings: MDsettings, cycle: int, name: str) -> Snapshots:
+    path = cv_file(settings, cycle, name)
+    if path.exists():
+        return Snapshots(np.load(path, mmap_mode="r"))
+    log = cv_file(settings, cycle, name, ".log")
+    if log.exists():
+        return Snapshots.from_list(read_log(log))
+    LOGGER.error(f"{path} is not found")
+    exit(1)
+
+
+def read_log(log: Path) -> List[Snapshot]:
+    """
+    parse cv.log or cv_ranked.log written by an older version
+    """
+    results = []
+    with open(log, "r") as f:
+        for line in f:
+            match = PATTERN_VECTOR.search(line)
+            if match:
+                cv = [float(x) for x in match.group(3).split()]
+            else:
+                match = PATTERN_SCALAR.search(line)
+                if match is None:
+                    LOGGER.error("pattern matching failed.")
+                    LOGGER.error(f"see {log}")
+                    exit(1)
+                cv = float(match.group(3))
+            results.append(Snapshot(int(match.group(1)), int(match.group(2)), cv))
+    return results
+
+
+def read_n_frames(settings: MDsettings, cycle: int) -> Dict[int, int]:
+    """
+    {replica: number of frames} of the trajectories of a cycle given by cv
+    """
+    if not exists(settings, cycle, "cv"):
+        return {}
+    snapshots = read(settings, cycle, "cv")
+    n_frames: Dict[int, int] = {}
+    for replica in np.unique(snapshots.replica).tolist():
+        frames = snapshots.frame[snapshots.replica == replica]
+        n_frames[replica] = int(frames.max()) + 1
+    return n_frames
@@ -0,0 +1,402 @@
+import asyncio
+import atexit
+import contextlib
+import dataclasses
+import os
+import shlex
+import signal
+import threading
+import time as module_time
+from pathlib import Path
+from typing import Callable, List, Optional, Set, Tuple
+
+from pacs.utils.logger import generate_logger
+
+LOGGER = generate_logger(__name__)
+
+# characters which require the command to be interpreted by a shell
+SHELL_CHARS = set("$`|;&<>*?~(){}")
+
+
+@dataclasses.dataclass
+class Command:
+    """
+    an external command (or a python function) executed by the CommandEngine
+
+    Attributes:
+        cmd (str): command line. a shell is spawned only if shell syntax is used
+        func (Callable): python function called instead of cmd (e.g. file removal)
+        log (str): file to which stdout and stderr are written
+        stdin (str): text given to stdin (replaces "echo ... |")
+        timeout (float): seconds after which the command is killed
+        errors (List[str]): messages logged when the command fails
+        check (bool): whether a non-zero exit code is regarded as an error
+        startup_files (List[str]): the command is regarded as started when all of
+            these files have been created or modified since the launch.
+            it is relaunched if they are not written in time
+        watch_files (List[str]): the command is regarded as hung when none of
+            these files grows for stall_timeout seconds
+        startup_timeout (float): seconds to wait for startup_files
+        stall_timeout (float): seconds without growth of watch_files (0: disabled)
+        max_retry (int): number of launches for startup/stall failures
+    """
+
+    cmd: str = None
+    func: Callable[[], None] = None
+    log: str = None
+    stdin: str = None
+    timeout: float = None
+    errors: List[str] = None
+    check: bool = True
+    startup_files: List[str] = None
+    watch_files: List[str] = None
+    startup_timeout: float = 60.0
+    stall_timeout: float = 0.0
+    max_retry: int = 20
+
+
+class Job:
+    """
+    a sequence of commands running on the CommandEngine
+
+    It has the same interface as mp.Process (sentinel, join, exitcode,
+    terminate and close), so that it can be scheduled together with
+    python worker processes by multiprocessing.connection.wait.
+    """
+
+    def __init__(self, engine: "CommandEngine", commands: List[Command]) -> None:
+        self.engine = engine
+        self.commands = commands
+        self.exitcode: Optional[int] = None
+        self.future = None
+        self.processes: List[asyncio.subprocess.Process] = []
+        # a byte is written to the pipe when the job has finished
+        self.sentinel, self._notify = os.pipe()
+        self._done = threading.Event()
+
+    def start(self) -> None:
+        self.future = self.engine.schedule(self)
+        # the job may be cancelled before it has started
+        self.future.add_done_callback(lambda _: self.finish(-signal.SIGTERM))
+
+    def finish(self, exitcode: int) -> None:
+        if self._done.is_set():
+            return
+        self.exitcode = exitcode
+        self._done.set()
+        os.write(self._notify, b"\0")
+
+    def join(self, timeout: float = None) -> None:
+        self._done.wait(timeout)
+
+    def terminate(self) -> None:
+        if self.future is not None:
+            self.future.cancel()
+
+    def kill(self) -> None:
+        for process in self.processes:
+            kill_group(process)
+
+    def close(self) -> None:
+        os.close(self.sentinel)
+        os.close(self._notify)
+
+
+def kill_group(process: asyncio.subprocess.Process) -> None:
+    """
+    kill a command and its children. every command is the leader of its own
+    process group, so that the program run by a shell (e.g. mpirun and its
+    ranks) is killed together with the shell
+    """
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class CommandEngine:
+    """
+    run external commands on an asyncio event loop in a background thread.
+
+    Commands are spawned directly from the event loop, so that hundreds of
+    tool invocations can run concurrently without forking the python
+    interpreter for each of them. At most max_concurrency commands run at a
+    time.
+    """
+
+    def __init__(self, max_concurrency: int = 256) -> None:
+        self.max_concurrency = max_concurrency
+        self.pid: int = None
+        self.loop: asyncio.AbstractEventLoop = None
+        # number of running commands, limited by max_concurrency at each launch
+        # so that a limit changed by get_engine applies to the next launches
+        self.n_running = 0
+        self.slot_freed: asyncio.Condition = None
+        self.lock = threading.Lock()
+        # jobs which have not finished, killed when the python process exits
+        self.jobs: Set[Job] = set()
+        atexit.register(self.kill_all)
+
+    def start_loop(self) -> None:
+        # the event loop does not survive fork, so a child process needs its own
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.loop = asyncio.new_event_loop()
+            self.n_running = 0
+            self.slot_freed = None
+            thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            thread.start()
+            self.pid = os.getpid()
+
+    def submit(self, commands: List[Command]) -> Job:
+        job = Job(self, commands)
+        job.start()
+        return job
+
+    def run(self, commands: List[Command]) -> int:
+        """
+        run commands in order and wait for them. returns the exit code
+        """
+        job = self.submit(commands)
+        job.join()
+        exitcode = job.exitcode
+        job.close()
+        return exitcode
+
+    def schedule(self, job: Job):
+        self.start_loop()
+        return asyncio.run_coroutine_threadsafe(self.run_job(job), self.loop)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        wait until fewer than max_concurrency commands are running
+        """
+        if self.slot_freed is None:
+            self.slot_freed = asyncio.Condition()
+        async with self.slot_freed:
+            await self.slot_freed.wait_for(
+                lambda: self.n_running < max(1, self.max_concurrency)
+            )
+            self.n_running += 1
+        try:
+            yield
+        finally:
+            async with self.slot_freed:
+                self.n_running -= 1
+                self.slot_freed.notify_all()
+
+    async def run_job(self, job: Job) -> None:
+        exitcode = 0
+        self.jobs.add(job)
+        try:
+            for command in job.commands:
+                async with self.slot():
+                    if command.func is not None:
+                        returncode = await self.run_func(command)
+                    elif command.startup_files is not None:
+                        returncode = await self.run_watched(job, command)
+                    else:
+                        returncode = await self.run_command(job, command)
+                if returncode != 0 and command.check:
+                    name = (
+                        command.cmd if command.func is None else command.func.__name__
+                    )
+                    for error in command.errors or [f"error occurred at {name}"]:
+                        LOGGER.error(error)
+                    exitcode = returncode
+                    break
+        except asyncio.CancelledError:
+            job.kill()
+            exitcode = -signal.SIGTERM
+        except Exception as e:
+            LOGGER.error(f"error occurred in command engine: {e}")
+            exitcode = 1
+        self.jobs.discard(job)
+        job.finish(exitcode)
+
+    def kill_all(self) -> None:
+        """
+        kill the commands of the unfinished jobs started by this process,
+        which are in their own process groups and would be left running
+        """
+        if self.pid != os.getpid():
+            return
+        for job in list(self.jobs):
+            job.kill()
+
+    async def run_func(self, command: Command) -> int:
+        try:
+            await self.loop.run_in_executor(None, command.func)
+        except Exception as e:
+            LOGGER.error(f"{type(e).__name__}: {e}")
+            return 1
+        return 0
+
+    async def spawn(self, job: Job, command: Command) -> asyncio.subprocess.Process:
+        stdin = asyncio.subprocess.PIPE if command.stdin is not None else None
+        stdout = open(command.log, "w") if command.log is not None else None
+        stderr = asyncio.subprocess.STDOUT if command.log is not None else None
+        try:
+            # a new session makes the command the leader of a process group,
+            # which is killed as a whole by kill_group
+            if SHELL_CHARS.isdisjoint(command.cmd):
+                process = await asyncio.create_subprocess_exec(
+                    *shlex.split(command.cmd),
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=stderr,
+                    start_new_session=True,
+                )
+            else:
+                process = await asyncio.create_subprocess_shell(
+                    command.cmd,
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=stderr,
+                    start_new_session=True,
+                )
+        finally:
+            if stdout is not None:
+                stdout.close()
+        job.processes.append(process)
+        if command.stdin is not None:
+            process.stdin.write(command.stdin.encode())
+            await process.stdin.drain()
+            process.stdin.close()
+        return process
+
+    async def kill(self, process: asyncio.subprocess.Process) -> None:
+        kill_group(process)
+        await process.wait()
+
+    async def run_command(self, job: Job, command: Command) -> int:
+        process = await self.spawn(job, command)
+        try:
+            return await asyncio.wait_for(process.wait(), timeout=command.timeout)
+        except asyncio.TimeoutError:
+            await self.kill(process)
+            LOGGER.error(f"{command.cmd} timed out after {command.timeout} s")
+            return 1
+
+    async def run_watched(self, job: Job, command: Command) -> int:
+        """
+        Launch a command and watch it until it exits.
+
+        The command is regarded as alive as soon as all startup_files have been
+        written since the launch, and as hung if it does not start within
+        startup_timeout or if none of watch_files grows for stall_timeout.
+        A hung command is killed and relaunched up to max_retry times, while
+        the return code of a command which exits before it starts is returned
+        at once.
+        """
+        poll_interval = 0.2
+        startup_files = [Path(file) for file in command.startup_files]
+        watch_files = [Path(file) for file in command.watch_files or []]
+
+        def stat(file: Path) -> Optional[Tuple[int, int]]:
+            if not file.exists():
+                return None
+            st = file.stat()
+            return (st.st_mtime_ns, st.st_size)
+
+        for _ in range(command.max_retry):
+            # startup files are kept (and appended to) when a run is resumed,
+            # so compare them with their state before the launch
+            before = [stat(file) for file in startup_files]
+            process = await self.spawn(job, command)
+
+            # wait until the command writes its startup files
+            started = False
+            deadline = module_time.monotonic() + command.startup_timeout
+            while module_time.monotonic() < deadline:
+                if all(
+                    stat(file) not in (None, state)
+                    for file, state in zip(startup_files, before)
+                ):
+                    started = True
+                    break
+                if process.returncode is not None:
+                    break
+                await asyncio.sleep(poll_interval)
+            if not started and process.returncode is not None:
+                # a command failing at once (e.g. with a bad input) is not retried
+                if process.returncode != 0:
+                    LOGGER.error(
+                        f"{command.cmd.split()[0]} exited with code "
+                        f"{process.returncode} before it started"
+                    )
+                return process.returncode
+            if not started:
+                await self.kill(process)
+                LOGGER.warning(f"{command.cmd.split()[0]} did not start, retrying")
+                await asyncio.sleep(5)
+                continue
+
+            # wait until the command exits, watching the growth of watch_files
+            sizes = [-1] * len(watch_files)
+            last_growth = module_time.monotonic()
+            hung = False
+            while process.returncode is None:
+                try:
+                    await asyncio.wait_for(process.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                if command.stall_timeout <= 0 or process.returncode is not None:
+                    continue
+                now_sizes = [
+                    file.stat().st_size if file.exists() else -1 for file in watch_files
+                ]
+                if now_sizes != sizes:
+                    sizes = now_sizes
+                    last_growth = module_time.monotonic()
+                elif module_time.monotonic() - last_growth > command.stall_timeout:
+                    hung = True
+                    break
+            if hung:
+                await self.kill(process)
+                LOGGER.warning(
+                    f"{command.cmd.split()[0]} stalled for "
+                    f"{command.stall_timeout} s, retrying"
+                )
+                await asyncio.sleep(5)
+                continue
+            return process.returncode
+
+        LOGGER.error(
+            f"{command.cmd.split()[0]} did not start or hung "
+            "due to some technical errors"
+        )
+        return 1
+
+
+ENGINE = CommandEngine()
+
+
+def get_engine(settings=None) -> CommandEngine:
+    """
+    returns the command engine shared in this process
+    """
+    if settings is not None:
+        # applied to the commands launched from now on
+        ENGINE.max_concurrency = settings.max_concurrent_commands
+    return ENGINE
+
+
+def remove_files(*patterns: str) -> Callable[[], None]:
+    """
+    returns a function removing the files matching the glob patterns,
+    to be used as Command(func=...) instead of spawning rm
+    """
+
+    def remove() -> None:
+        for pattern in patterns:
+            path = Path(pattern)
+            for file in path.parent.glob(path.name):
+                if file.is_file():
+                    file.unlink()
+
+    return remove
@@ -1,6 +1,7 @@
 import multiprocessing as mp
 from pathlib import Path
 
+import pacs.utils.state as state
 from pacs.models.settings import MDsettings
 from pacs.utils.logger import generate_logger
 
@@ -16,7 +17,12 @@ def fit(settings: MDsettings, trj_file: str, out_file: str) -> None:
 
 def fit_trial(settings: MDsettings, trj_file: str, out_file: str) -> None:
     job_list = []
-    for path in Path(".").glob(f"./trial{settings.trial:03}/cycle*/replica*"):
+    paths = [
+        settings.each_replica(_cycle=cycle, _replica=replica)
+        for cycle, replicas in state.replicas_by_cycle(settings).items()
+        for replica in replicas
+    ]
+    for path in paths:
         if not Path(f"{path}/{trj_file}").exists():
             LOGGER.error(f"trajectory file {path}/{trj_file} is not found.")
             exit(1)
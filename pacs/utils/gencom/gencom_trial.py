@@ -1,5 +1,7 @@
+import copy
 from pathlib import Path
 
+import pacs.utils.state as state
 from pacs.models.settings import MDsettings
 from pacs.utils.logger import generate_logger
 
@@ -37,12 +39,14 @@ def gencom_trial_mdtraj(
     lig_selection = settings.selection1
     LOGGER.info("This command is strongly recommended after fitting the trajectory.")
 
+    trial_settings = copy.copy(settings)
+    trial_settings.trial = trial
+    layout = state.replicas_by_cycle(trial_settings)
+    last_cycle = state.last_analyzed_cycle(trial_settings)
+
     concat_lig_com = []
-    for cycle in range(1, 10000):
-        cycle_dir = settings.each_cycle(_trial=trial, _cycle=cycle)
-        if not Path(f"{cycle_dir}/summary/cv_ranked.log").exists():
-            break
-        for rep in range(1, 10000):
+    for cycle in range(1, last_cycle + 1):
+        for rep in layout.get(cycle, []):
             rep_dir = settings.each_replica(_trial=trial, _cycle=cycle, _replica=rep)
             trj_file = f"{rep_dir}/{trjfile_name}"
             if Path(trj_file).exists():
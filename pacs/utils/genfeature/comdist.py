@@ -1,6 +1,8 @@
 import numpy as np
+from pacs.utils.com import com_distance
 from pacs.utils.genfeature.genfeat import GenFeatureCore
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_selections
 
 LOGGER = generate_logger(__name__)
 
@@ -10,16 +12,12 @@ def cal_feature(
     topology: str,
     selection1: str,
     selection2: str,
+    cache_dir: str = None,
 ) -> np.ndarray:
-    import mdtraj as md
-
-    trj = md.load(
-        f"{trj_path}",
-        top=topology,
+    trj, (index1, index2) = load_selections(
+        f"{trj_path}", topology, [selection1, selection2], cache_dir=cache_dir
     )
-    com1 = md.compute_center_of_mass(trj.atom_slice(trj.topology.select(selection1)))
-    com2 = md.compute_center_of_mass(trj.atom_slice(trj.topology.select(selection2)))
-    return np.array([np.linalg.norm(com1[i] - com2[i]) for i in range(len(com1))])
+    return com_distance(trj, index1, index2)
 
 
 def cal_feature_trial(
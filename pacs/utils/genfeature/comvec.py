@@ -1,6 +1,8 @@
 import numpy as np
+from pacs.utils.com import COMEngine
 from pacs.utils.genfeature.genfeat import GenFeatureCore
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_reference, load_selections, select
 
 LOGGER = generate_logger(__name__)
 
@@ -13,23 +15,23 @@ def cal_feature(
     selection_fit_ref: str,
     selection1: str,
     selection2: str,
+    cache_dir: str = None,
 ) -> np.ndarray:
-    import mdtraj as md
-
-    trj = md.load(
+    trj, (fit_index, index1, index2) = load_selections(
         f"{trj_path}",
-        top=topology,
+        topology,
+        [selection_fit_trj, selection1, selection2],
+        cache_dir=cache_dir,
     )
-    ref = md.load(reference)
+    ref = load_reference(reference, cache_dir=cache_dir)
     trj.superpose(
         ref,
         0,
-        atom_indices=trj.top.select(selection_fit_trj),
-        ref_atom_indices=ref.top.select(selection_fit_ref),
+        atom_indices=fit_index,
+        ref_atom_indices=select(reference, selection_fit_ref, cache_dir),
     )
-    com1 = md.compute_center_of_mass(trj.atom_slice(trj.topology.select(selection1)))
-    com2 = md.compute_center_of_mass(trj.atom_slice(trj.topology.select(selection2)))
-    return np.array([com1[i] - com2[i] for i in range(len(com1))])
+    com = COMEngine(trj.topology, [index1, index2]).compute(trj.xyz)
+    return com[:, 0, :] - com[:, 1, :]
 
 
 def cal_feature_trial(
@@ -1,9 +1,10 @@
 import concurrent.futures
-import re
 from dataclasses import dataclass
 from pathlib import Path
 
 import numpy as np
+import pacs.utils.state as state
+from pacs.models.settings import MDsettings
 from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
@@ -35,20 +36,23 @@ class GenFeatureCore:
         with concurrent.futures.ProcessPoolExecutor(
             max_workers=self.n_parallel
         ) as executor:
-            for path in Path(".").glob(f"./trial{self.trial:03}/cycle*/replica*"):
-                if not Path(f"{path}/{self.trj_filename}").exists():
-                    LOGGER.error(
-                        f"trajectory file {path}/{self.trj_filename} is not found."
+            settings = MDsettings(trial=self.trial)
+            layout = state.replicas_by_cycle(settings)
+            # topologies and selections are parsed once per trial
+            cache_dir = settings.cache_dir()
+            for cycle, replicas in layout.items():
+                for replica in replicas:
+                    trj_path = f"./trial{self.trial:03}/cycle{cycle:03}/replica{replica:03}/{self.trj_filename}"  # noqa B950
+                    if not Path(trj_path).exists():
+                        LOGGER.error(f"trajectory file {trj_path} is not found.")
+                        exit(1)
+
+                    future = executor.submit(
+                        calc_feature, trj_path, *args, cache_dir=cache_dir, **kwargs
+                    )
+                    job_dict_list.append(
+                        {"future": future, "cycle": cycle, "replica": replica}
                     )
-                    exit(1)
-                cycle = int(re.findall(r"(\d+)", str(path))[1])
-                replica = int(re.findall(r"(\d+)", str(path))[2])
-                trj_path = f"./trial{self.trial:03}/cycle{cycle:03}/replica{replica:03}/{self.trj_filename}"  # noqa B950
-
-                future = executor.submit(calc_feature, trj_path, *args, **kwargs)
-                job_dict_list.append(
-                    {"future": future, "cycle": cycle, "replica": replica}
-                )
 
             for job_info in job_dict_list:
                 future = job_info["future"]
@@ -1,6 +1,7 @@
 import numpy as np
 from pacs.utils.genfeature.genfeat import GenFeatureCore
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_reference, load_selections, select
 
 LOGGER = generate_logger(__name__)
 
@@ -13,28 +14,27 @@ def cal_feature(
     selection_fit_ref: str,
     selection_cal_trj: str,
     selection_cal_ref: str,
+    cache_dir: str = None,
 ) -> np.ndarray:
-    import mdtraj as md
-
-    trj = md.load(
+    trj, (fit_index, cal_index) = load_selections(
         f"{trj_path}",
-        top=topology,
+        topology,
+        [selection_fit_trj, selection_cal_trj],
+        cache_dir=cache_dir,
     )
-    ref = md.load(reference)
+    ref = load_reference(reference, cache_dir=cache_dir)
     trj.superpose(
         ref,
         0,
-        atom_indices=trj.top.select(selection_fit_trj),
-        ref_atom_indices=ref.top.select(selection_fit_ref),
+        atom_indices=fit_index,
+        ref_atom_indices=select(reference, selection_fit_ref, cache_dir),
     )
+    ref_cal_index = select(reference, selection_cal_ref, cache_dir)
     # md.rmsd performs superposition automatically, so we don't use that typeality here
     rmsd = np.sqrt(
         3
         * np.mean(
-            np.square(
-                trj.xyz[:, trj.top.select(selection_cal_trj)]
-                - ref.xyz[:, ref.top.select(selection_cal_ref)]
-            ),
+            np.square(trj.xyz[:, cal_index] - ref.xyz[:, ref_cal_index]),
             axis=(1, 2),
         )
     )
@@ -1,6 +1,7 @@
 import numpy as np
 from pacs.utils.genfeature.genfeat import GenFeatureCore
 from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_selections
 
 LOGGER = generate_logger(__name__)
 
@@ -9,14 +10,10 @@ def cal_feature(
     trj_path: str,
     topology: str,
     selection: str,
+    cache_dir: str = None,
 ) -> np.ndarray:
-    import mdtraj as md
-
-    trj = md.load(
-        f"{trj_path}",
-        top=topology,
-    )
-    return trj.atom_slice(trj.topology.select(selection)).xyz
+    trj, _ = load_selections(f"{trj_path}", topology, [selection], cache_dir=cache_dir)
+    return trj.xyz
 
 
 def cal_feature_trial(
@@ -3,6 +3,8 @@ from pathlib import Path
 from typing import Dict
 
 import numpy as np
+import pacs.utils.cvstore as cvstore
+import pacs.utils.state as state
 from pacs.models.settings import MDsettings
 from pacs.utils.logger import generate_logger
 
@@ -35,20 +37,11 @@ def genrepresent_mdtraj(settings: MDsettings) -> None:
     ext = settings.trajectory_extension
     trajs = []
     for cycle in range(last_cycle, -1, -1):  # itration until cycle 0
-        cycle_dir = settings.each_cycle(_cycle=cycle)
         if cycle == last_cycle:
             selected_replica = 1
-        with open(f"{cycle_dir}/summary/cv_ranked.log", "r") as f:
-            for idx, line in enumerate(f):
-                if idx == (selected_replica - 1):
-                    line = line.strip()
-                    (_, selected_replica, _, last_frame, _, _) = line.split(" ")
-                    last_frame = int(last_frame)
-                    selected_replica = int(selected_replica)
-                    LOGGER.info(
-                        f"cycle: {cycle}, replica: {selected_replica}, frame: {last_frame}"
-                    )
-                    break
+        snapshot = cvstore.read(settings, cycle, "cv_ranked")[selected_replica - 1]
+        selected_replica, last_frame = snapshot.replica, snapshot.frame
+        LOGGER.info(f"cycle: {cycle}, replica: {selected_replica}, frame: {last_frame}")
 
         # extract trajectory
         rep_dir = Path(settings.each_replica(_cycle=cycle, _replica=selected_replica))
@@ -81,20 +74,11 @@ def genrepresent_gmx(settings: MDsettings) -> None:
     # exetract the repr trajectory from each cycle
     ext = settings.trajectory_extension
     for cycle in range(last_cycle, -1, -1):  # itration until cycle 0
-        cycle_dir = settings.each_cycle(_cycle=cycle)
         if cycle == last_cycle:
             selected_replica = 1
-        with open(f"{cycle_dir}/summary/cv_ranked.log", "r") as f:
-            for idx, line in enumerate(f):
-                if idx == (selected_replica - 1):
-                    line = line.strip()
-                    (_, selected_replica, _, last_frame, _, _) = line.split(" ")
-                    last_frame = int(last_frame)
-                    selected_replica = int(selected_replica)
-                    LOGGER.info(
-                        f"cycle: {cycle}, replica: {selected_replica}, frame: {last_frame}"
-                    )
-                    break
+        snapshot = cvstore.read(settings, cycle, "cv_ranked")[selected_replica - 1]
+        selected_replica, last_frame = snapshot.replica, snapshot.frame
+        LOGGER.info(f"cycle: {cycle}, replica: {selected_replica}, frame: {last_frame}")
         rep_dir = Path(settings.each_replica(_cycle=cycle, _replica=selected_replica))
         trj = f"{rep_dir}/{settings.trajectory}"
         top = settings.topology
@@ -147,20 +131,11 @@ def genrepresent_cpptraj(settings: MDsettings) -> None:
     # exetract the repr trajectory from each cycle
     ext = settings.trajectory_extension
     for cycle in range(last_cycle, -1, -1):  # itration until cycle 0
-        cycle_dir = settings.each_cycle(_cycle=cycle)
         if cycle == last_cycle:
             selected_replica = 1
-        with open(f"{cycle_dir}/summary/cv_ranked.log", "r") as f:
-            for idx, line in enumerate(f):
-                if idx == (selected_replica - 1):
-                    line = line.strip()
-                    (_, selected_replica, _, last_frame, _, _) = line.split(" ")
-                    last_frame = int(last_frame)
-                    selected_replica = int(selected_replica)
-                    LOGGER.info(
-                        f"cycle: {cycle}, replica: {selected_replica}, frame: {last_frame}"
-                    )
-                    break
+        snapshot = cvstore.read(settings, cycle, "cv_ranked")[selected_replica - 1]
+        selected_replica, last_frame = snapshot.replica, snapshot.frame
+        LOGGER.info(f"cycle: {cycle}, replica: {selected_replica}, frame: {last_frame}")
         rep_dir = Path(settings.each_replica(_cycle=cycle, _replica=selected_replica))
         trj = f"{rep_dir}/{settings.trajectory}"
         top = settings.topology
@@ -175,7 +150,8 @@ def genrepresent_cpptraj(settings: MDsettings) -> None:
             f.write("\n".join(cmd_cpptraj))
 
         res_cpptraj = subprocess.run(
-            f"cpptraj -i {repr_dir}/genrepresent.cpptraj 1> {repr_dir}/genrepresent.log \
+            f"{settings.cmd_cpptraj} -i {repr_dir}/genrepresent.cpptraj \
+                    1> {repr_dir}/genrepresent.log \
                     2> {repr_dir}/genrepresent.log --log {repr_dir}/repr_dir.log",
             shell=True,
         )
@@ -194,7 +170,7 @@ def genrepresent_cpptraj(settings: MDsettings) -> None:
     with open(f"{repr_dir}/trjcat.cpptraj", "w") as f:
         f.write("\n".join(cmd_cpptraj))
     res_cpptraj = subprocess.run(
-        f"cpptraj -i {repr_dir}/trjcat.cpptraj 1> {repr_dir}/trjcat.log \
+        f"{settings.cmd_cpptraj} -i {repr_dir}/trjcat.cpptraj 1> {repr_dir}/trjcat.log \
                 2>&1 {repr_dir}/trjcat.log --log {repr_dir}/trjcat.log",
         shell=True,
     )
@@ -229,15 +205,10 @@ def load_frame_to_time(settings: MDsettings) -> Dict[int, float]:
 
 
 def detect_lastcycle(settings: MDsettings) -> int:
-    # detect the last cycle
-    last_cycle = 0
-    for cycle in range(1, settings.max_cycle + 1):
-        cycle_dir = Path(settings.each_cycle(_cycle=cycle))
-        if not (cycle_dir / "summary/cv_ranked.log").exists():
-            last_cycle = cycle - 1
-            break
-    if last_cycle == 0:
-        LOGGER.error("cv_ranked.log is not found")
+    # detect the last cycle from the manifest of the trial
+    last_cycle = min(state.last_analyzed_cycle(settings), settings.max_cycle)
+    if last_cycle <= 0:
+        LOGGER.error("cv_ranked.npy is not found")
         LOGGER.error("please check the simulation")
         exit(1)
     return last_cycle
@@ -37,3 +37,18 @@ def close_logger(logger):
     file_handler = getattr(logger, "file_handler", None)
     if file_handler is not None:
         file_handler.close()
+
+
+def add_file_handler(log_file: str) -> FileHandler:
+    """
+    write the messages of all loggers in this process to log_file as well
+    """
+    logfmt = (
+        "%(levelname)-9s  %(asctime)s  [%(filename)-17s - %(funcName)-17s] %(message)s"
+    )
+    datefmt = "%Y-%m-%d %H:%M:%S"
+    file_handler = FileHandler(f"{log_file}", mode="a", encoding="utf-8")
+    file_handler.setLevel(DEBUG)
+    file_handler.setFormatter(CenteredFormatter(logfmt, datefmt=datefmt))
+    getLogger().addHandler(file_handler)
+    return file_handler
@@ -3,6 +3,7 @@ import re
 import sys
 from collections import defaultdict
 from pathlib import Path
+from typing import List
 
 import tomli
 from pacs._version import __version__
@@ -15,6 +16,7 @@ from pacs.utils.genrepresent import genrepresent
 from pacs.utils.logger import generate_logger
 from pacs.utils.rmfile import rmfile_all
 from pacs.utils.rmmol import make_top, rmmol_all, rmmol_log_add_info
+from pacs.utils.state import rebuild
 
 # toml lib is not used
 
@@ -38,7 +40,8 @@ class Parser:
             "--trial",
             type=str,
             required=True,
-            help="trial number without 0-fill when pacsmd was conducted (e.g. -t 1)",
+            help="trial number without 0-fill when pacsmd was conducted (e.g. -t 1). "
+            "several trials run concurrently with a range or list (e.g. -t 1-30)",
         )
         parser_mdrun.add_argument(
             "-f",
@@ -268,6 +271,28 @@ class Parser:
             help="Name of simulator used in when using PaCS-MD",
         )
 
+        # manifest
+        parser_manifest = subparsers.add_parser(
+            "manifest",
+            help="rebuild the manifest (state.db) of a trial made by an older version",
+        )
+
+        parser_manifest.add_argument(
+            "-t",
+            "--trial",
+            type=int,
+            required=True,
+            help="trial number without 0-fill when pacsmd was conducted (e.g. -t 1)",
+        )
+
+        parser_manifest.add_argument(
+            "-e",
+            "--trajectory_extension",
+            type=str,
+            required=True,
+            help="trajectory extension. (e.g. -e .xtc, -e .nc, -e .dcd)",
+        )
+
         # fit
         parser_fit = subparsers.add_parser(
             "fit",
@@ -834,7 +859,9 @@ class Parser:
                 LOGGER.error("please specify input file")
                 exit(1)
             toml = self.read_input(args.file)
-            toml["trial"] = args.trial
+            trials = self.parse_trials(args.trial)
+            toml["trial"] = trials[0]
+            toml["trials"] = trials
             try:
                 conf = MDsettings(**toml)
             except Exception:
@@ -919,6 +946,17 @@ class Parser:
             rmfile_all(conf)
             exit(0)
 
+        if sys.argv[1] == "manifest":
+            dic = defaultdict()
+            dic["trial"] = int(args.trial)
+            dic["trajectory_extension"] = args.trajectory_extension
+            conf = MDsettings(**dic)
+            if not Path(conf.each_trial()).exists():
+                LOGGER.error(f"{conf.each_trial()} does not exist")
+                exit(1)
+            rebuild(conf)
+            exit(0)
+
         if sys.argv[1] == "fit":
             if len(sys.argv) == 2:
                 LOGGER.error("Use -h")
@@ -1045,6 +1083,26 @@ class Parser:
                 )
             exit(0)
 
+    def parse_trials(self, text: str) -> List[int]:
+        """
+        parse the trial numbers of -t (e.g. "1", "1-30", "1,3,5-8")
+        """
+        trials: List[int] = []
+        for token in text.split(","):
+            match = re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?", token)
+            if match is None:
+                LOGGER.error(f"invalid trial number: {text}")
+                exit(1)
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) is not None else start
+            if end < start:
+                LOGGER.error(f"invalid trial range: {token}")
+                exit(1)
+            for trial in range(start, end + 1):
+                if trial not in trials:
+                    trials.append(trial)
+        return trials
+
     def parse_line(self, line: str):
         pattern = re.compile(r"([^=]+)\s*=\s*(.+)")
         match = pattern.match(line)
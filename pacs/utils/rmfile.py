@@ -1,45 +1,40 @@
-import subprocess
+import time
 from pathlib import Path
 
+import pacs.utils.state as state
 from pacs.models.settings import MDsettings
-from pacs.utils.logger import close_logger, generate_logger
+from pacs.utils.logger import generate_logger
 
 LOGGER = generate_logger(__name__)
 
 
 def detect_n_replica(settings: MDsettings, cycle: int) -> int:
-    # detect number of replicas
-    for replica in range(1, 1000):
-        replica_dir = Path(settings.each_replica(_cycle=cycle, _replica=replica))
-        if not replica_dir.exists():
-            n_replica = replica - 1
-            break
-
+    # detect number of replicas from the manifest of the trial
+    n_replica = len(state.finished_replicas(settings, cycle))
     if n_replica == 0:
-        LOGGER.error(f"replica directory does not exist in cycle{cycle:03}")
+        LOGGER.error(f"no replica is recorded in cycle{cycle:03}")
         exit(1)
     return n_replica
 
 
 def detect_n_cycle(settings: MDsettings) -> int:
-    max_cycle = 0
-    for cycle in range(1000):
-        cycle_dir = Path(settings.each_cycle(_cycle=cycle))
-        if not cycle_dir.exists():
-            max_cycle = cycle - 1
-            break
-    return max_cycle
+    return max(state.replicas_by_cycle(settings).keys())
 
 
 def run_rm(file_name: str) -> None:
-    cmd_rm = f"rm -f {file_name}"
-    res_rm = subprocess.run(cmd_rm, shell=True)
-    if res_rm.returncode != 0:
+    # remove the files matching the pattern without spawning rm
+    path = Path(file_name)
+    try:
+        for file in path.parent.glob(path.name):
+            if file.is_file():
+                file.unlink()
+    except OSError:
         LOGGER.error(f"error occurred at rm {file_name} command")
         exit(1)
 
 
 def rmfile(settings: MDsettings, cycle: int) -> None:
+    started = time.time()
     n_replica = detect_n_replica(settings, cycle)
     for replica in range(1, n_replica + 1):
         dir = settings.each_replica(_cycle=cycle, _replica=replica)
@@ -49,7 +44,7 @@ def rmfile(settings: MDsettings, cycle: int) -> None:
             run_rm(f"{dir}/mdout.mdp")
 
             # .cpt
-            run_rm(f"-f {dir}/*.cpt")
+            run_rm(f"{dir}/*.cpt")
 
             # .tpr
             # keep .tpr files if rmmol=false in mdrun,  in case you want to do rmmol afterward
@@ -57,7 +52,7 @@ def rmfile(settings: MDsettings, cycle: int) -> None:
                 run_rm(f"{dir}/prd.tpr")
 
             # '#backup#': use -f
-            run_rm(f"-f {dir}/\#*")  # NOQA: W605
+            run_rm(f"{dir}/#*")
 
             # output structure prd
             run_rm(f"{dir}/prd.gro")
@@ -99,14 +94,12 @@ def rmfile(settings: MDsettings, cycle: int) -> None:
             continue
 
     # LOGGER.info(f"rmfile completed successfully in cycle{cycle:03}")
-    record_finished(settings, cycle)
+    record_finished(settings, cycle, started)
 
 
-def record_finished(settings: MDsettings, cycle: int) -> None:
-    dir = settings.each_cycle(_cycle=cycle)
-    logger = generate_logger(f"{cycle}_rmfile", f"{dir}/summary/progress.log")
-    logger.info(f"rmfile completed successfully in cycle{cycle:03}")
-    close_logger(logger)
+def record_finished(settings: MDsettings, cycle: int, started: float = None) -> None:
+    state.record(settings, cycle, "rmfile", started=started)
+    LOGGER.info(f"rmfile completed successfully in cycle{cycle:03}")
 
 
 def rmfile_all(settings: MDsettings) -> None:
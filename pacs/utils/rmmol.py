@@ -1,36 +1,27 @@
 import multiprocessing as mp
 import subprocess
+import time
 from pathlib import Path
 
+import pacs.utils.state as state
 from pacs.models.settings import MDsettings
-from pacs.utils.logger import close_logger, generate_logger
+from pacs.utils.logger import generate_logger
+from pacs.utils.selection import load_selections, load_topology, select
 
 LOGGER = generate_logger(__name__)
 
 
 def detect_n_replica(settings: MDsettings, cycle: int) -> int:
-    # detect the n_replica in cycle001
-    n_replica = 0
-    for replica in range(1, 1000):
-        replica_dir = Path(settings.each_replica(_cycle=cycle, _replica=replica))
-        if not replica_dir.exists():
-            n_replica = replica - 1
-            break
-
+    # detect the n_replica from the manifest of the trial
+    n_replica = len(state.finished_replicas(settings, cycle))
     if n_replica == 0:
-        LOGGER.error(f"replica directory does not exist in cycle{cycle:03}")
+        LOGGER.error(f"no replica is recorded in cycle{cycle:03}")
         exit(1)
     return n_replica
 
 
 def detect_n_cycle(settings: MDsettings) -> int:
-    max_cycle = 0
-    for cycle in range(1, 1000):
-        cycle_dir = Path(settings.each_cycle(_cycle=cycle))
-        if not cycle_dir.exists():
-            max_cycle = cycle - 1
-            break
-    return max_cycle
+    return max(state.replicas_by_cycle(settings).keys())
 
 
 def make_top(settings: MDsettings) -> None:
@@ -55,12 +46,13 @@ def make_top_mdtraj(settings: MDsettings) -> None:
     if not Path(f"{dir}/prd{ext}").exists():
         LOGGER.error(f"{dir}/prd{ext} does not exist")
         exit(1)
+    cache_dir = settings.cache_dir()
     traj = md.load_frame(
         f"{dir}/prd{ext}",
         index=0,
-        top=settings.top_mdtraj,
+        top=load_topology(settings.top_mdtraj, cache_dir),
     )
-    keep_select = traj.top.select(settings.keep_selection)
+    keep_select = select(settings.top_mdtraj, settings.keep_selection, cache_dir)
     extracted_traj = traj.atom_slice(keep_select)
     extracted_traj.save(f"{dir}/rmmol_top.pdb")
     LOGGER.info(f"topology file rmmol_top.pdb has been created in {dir}")
@@ -121,7 +113,7 @@ def make_top_cpptraj(settings: MDsettings) -> None:
     ]
     with open(f"{dir}/make_top.cpptraj", "w") as f:
         f.write("\n".join(cmd_cpptraj))
-    run_cpptraj = f"cpptraj \
+    run_cpptraj = f"{settings.cmd_cpptraj} \
             -i {dir}/make_top.cpptraj \
             1> {dir}/make_top.log 2>&1"  # NOQA: E221
     res_cpptraj = subprocess.run(run_cpptraj, shell=True)
@@ -132,6 +124,7 @@ def make_top_cpptraj(settings: MDsettings) -> None:
 
 
 def rmmol(settings: MDsettings, cycle: int, last_cycle: bool) -> None:
+    started = time.time()
     n_replica = detect_n_replica(settings, cycle)
     n_loop = (n_replica + settings.n_parallel - 1) // settings.n_parallel
     replicas = [x + 1 for x in range(n_replica)]
@@ -170,15 +163,16 @@ def rmmol(settings: MDsettings, cycle: int, last_cycle: bool) -> None:
         for p in processes:
             p.close()
 
-    # LOGGER.info(f"trajectory files in cycle{cycle:03} have been reduced")
-    record_finished(settings, cycle)
+    ext = settings.trajectory_extension
+    for replica in replicas:
+        state.record_trajectory(settings, cycle, replica, f"prd_rmmol{ext}")
+        state.record_trajectory(settings, cycle, replica, f"prd{ext}")
+    record_finished(settings, cycle, started)
 
 
 def rmmol_replica_mdtraj(
     settings: MDsettings, cycle: int, replica: int, last_cycle: bool
 ) -> None:
-    import mdtraj as md
-
     ext = settings.trajectory_extension
     if cycle == 0 and replica >= 2:
         return
@@ -189,15 +183,20 @@ def rmmol_replica_mdtraj(
         return
 
     # create new trajectory without water
-    traj = md.load(f"{dir}/prd{ext}", top=settings.top_mdtraj)
-    keep_select = traj.top.select(settings.keep_selection)
-    extracted_traj = traj.atom_slice(keep_select)
+    # only the kept atoms are read from the trajectory
+    extracted_traj, _ = load_selections(
+        f"{dir}/prd{ext}",
+        settings.top_mdtraj,
+        [settings.keep_selection],
+        cache_dir=settings.cache_dir(),
+    )
     extracted_traj.save(f"{dir}/prd_rmmol{ext}")
 
     # remove previous trajectory
     if not last_cycle:
-        res_rm = subprocess.run(f"rm {dir}/prd{ext}", shell=True)
-        if res_rm.returncode != 0:
+        try:
+            Path(f"{dir}/prd{ext}").unlink()
+        except OSError:
             LOGGER.error("error occurred at rm command")
             exit(1)
 
@@ -235,8 +234,9 @@ def rmmol_replica_gmx(
 
     # remove previous trajectory
     if not last_cycle:
-        res_rm = subprocess.run(f"rm {dir}/prd{ext}", shell=True)
-        if res_rm.returncode != 0:
+        try:
+            Path(f"{dir}/prd{ext}").unlink()
+        except OSError:
             LOGGER.error("error occurred at rm command")
             exit(1)
 
@@ -267,15 +267,17 @@ def rmmol_replica_cpptraj(
         f.write("\n".join(cmd_cpptraj))
 
     res_cpptraj = subprocess.run(
-        f"cpptraj -i {dir}/rmmol.cpptraj 1> {dir}/rmmol.log 2>&1", shell=True
+        f"{settings.cmd_cpptraj} -i {dir}/rmmol.cpptraj 1> {dir}/rmmol.log 2>&1",
+        shell=True,
     )
     if res_cpptraj.returncode != 0:
         LOGGER.error("error occurred at cpptraj command")
         exit(1)
     # remove previous trajectory
     if not last_cycle:
-        res_rm = subprocess.run(f"rm {dir}/prd{ext}", shell=True)
-        if res_rm.returncode != 0:
+        try:
+            Path(f"{dir}/prd{ext}").unlink()
+        except OSError:
             LOGGER.error("error occurred at rm command")
             exit(1)
 
@@ -292,11 +294,9 @@ def rmmol_log_add_info(settings: MDsettings) -> None:
         exit(1)
 
 
-def record_finished(settings: MDsettings, cycle: int) -> None:
-    dir = settings.each_cycle(_cycle=cycle)
-    logger = generate_logger(f"{cycle}_rmmol", f"{dir}/summary/progress.log")
-    logger.info(f"trajectory files in cycle{cycle:03} have been reduced")
-    close_logger(logger)
+def record_finished(settings: MDsettings, cycle: int, started: float = None) -> None:
+    state.record(settings, cycle, "rmmol", started=started)
+    LOGGER.info(f"trajectory files in cycle{cycle:03} have been reduced")
 
 
 def rmmol_log_add_info_gmx(settings: MDsettings) -> None:
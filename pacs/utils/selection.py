@@ -0,0 +1,289 @@
+"""
+cache of the parsed topologies, reference structures and resolved selections
+(mdtraj selections and gromacs index groups)
+
+The cache is kept in memory by each process and, if cache_dir is given,
+on disk (settings.cache_dir(), i.e. trialNNN/cache) so that it is shared by
+the worker processes of all replicas and cycles of a trial.
+Each entry is keyed on the path, modification time and size of its file,
+so that an edited topology or reference is parsed again.
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from pacs.utils.logger import generate_logger
+
+LOGGER = generate_logger(__name__)
+
+_TOPOLOGIES: Dict[str, object] = {}
+_SELECTIONS: Dict[Tuple[str, str], np.ndarray] = {}
+_REFERENCES: Dict[Tuple[str, str], Dict[str, np.ndarray]] = {}
+
+
+def file_key(file: str) -> str:
+    path = Path(file).resolve()
+    st = path.stat()
+    text = f"{path}:{st.st_mtime_ns}:{st.st_size}"
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def store(path: Path, write) -> None:
+    """
+    write a cache file atomically, the other processes may read it at any time
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except Exception as e:
+        # the cache is an optimization, go on without it
+        LOGGER.warning(f"failed to write the cache {path}: {e}")
+        if tmp.exists():
+            tmp.unlink()
+
+
+def load_topology(top: str, cache_dir: str = None):
+    """
+    md.Topology of top, parsed once
+    """
+    import mdtraj as md
+
+    key = file_key(top)
+    if key in _TOPOLOGIES:
+        return _TOPOLOGIES[key]
+
+    topology = None
+    path = None if cache_dir is None else Path(f"{cache_dir}/topology_{key}.pkl")
+    if path is not None and path.exists():
+        try:
+            with open(path, "rb") as f:
+                topology = pickle.load(f)
+        except Exception:
+            topology = None
+    if topology is None:
+        topology = md.load_topology(top)
+        if path is not None:
+            store(path, lambda f: pickle.dump(topology, f))
+    _TOPOLOGIES[key] = topology
+    return topology
+
+
+def select(top: str, selection: str, cache_dir: str = None) -> np.ndarray:
+    """
+    atom indices of selection in top, evaluated once
+    """
+    key = (file_key(top), selection)
+    if key in _SELECTIONS:
+        return _SELECTIONS[key]
+
+    index = None
+    name = hashlib.sha1(selection.encode()).hexdigest()[:16]
+    path = None
+    if cache_dir is not None:
+        path = Path(f"{cache_dir}/selection_{key[0]}_{name}.npy")
+    if path is not None and path.exists():
+        try:
+            index = np.load(path)
+        except Exception:
+            index = None
+    if index is None:
+        index = load_topology(top, cache_dir).select(selection)
+        if path is not None:
+            store(path, lambda f: np.save(f, index))
+    if len(index) == 0:
+        LOGGER.error(f"no atom is selected by '{selection}'")
+        exit(1)
+    _SELECTIONS[key] = index
+    return index
+
+
+def load_reference(reference: str, top: str = None, cache_dir: str = None):
+    """
+    md.Trajectory of reference (with top if given), read once.
+    a new Trajectory is returned every time, so that it can be modified
+    """
+    import mdtraj as md
+
+    if top is None:
+        top = reference
+    key = (file_key(reference), file_key(top))
+    arrays = _REFERENCES.get(key)
+    path = None
+    if cache_dir is not None:
+        path = Path(f"{cache_dir}/reference_{key[0]}_{key[1]}.npz")
+    if arrays is None and path is not None and path.exists():
+        try:
+            with np.load(path) as npz:
+                arrays = dict(npz)
+        except Exception:
+            arrays = None
+    if arrays is None:
+        ref = md.load(reference, top=load_topology(top, cache_dir))
+        arrays = {"xyz": ref.xyz, "time": ref.time}
+        if ref.unitcell_vectors is not None:
+            arrays["unitcell_lengths"] = ref.unitcell_lengths
+            arrays["unitcell_angles"] = ref.unitcell_angles
+        if path is not None:
+            store(path, lambda f: np.savez(f, **arrays))
+    _REFERENCES[key] = arrays
+    return md.Trajectory(
+        arrays["xyz"].copy(),
+        load_topology(top, cache_dir),
+        time=arrays["time"],
+        unitcell_lengths=arrays.get("unitcell_lengths"),
+        unitcell_angles=arrays.get("unitcell_angles"),
+    )
+
+
+def selected_atoms(
+    top: str, selections: List[str], cache_dir: str = None
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    @return
+    atom_indices:np.ndarray union of the atoms of the selections in top
+    indices:List[np.ndarray] indices of the atoms of each selection in atom_indices
+    """
+    selected = [select(top, selection, cache_dir) for selection in selections]
+    atom_indices = np.unique(np.concatenate(selected))
+    return atom_indices, [np.searchsorted(atom_indices, index) for index in selected]
+
+
+def load_selections(
+    trj_file: str,
+    top: str,
+    selections: List[str],
+    cache_dir: str = None,
+    start: int = 0,
+    stride: int = 1,
+) -> Tuple[object, List[np.ndarray]]:
+    """
+    load only the atoms of the union of the selections from trj_file,
+    so that the solvent is neither decoded nor kept in memory.
+    only every stride-th frame from the start-th frame is read
+
+    @return
+    trj:md.Trajectory trajectory of the selected atoms
+    indices:List[np.ndarray] indices of the atoms of each selection in trj
+    """
+    import mdtraj as md
+
+    topology = load_topology(top, cache_dir)
+    atom_indices, indices = selected_atoms(top, selections, cache_dir)
+    if start == 0:
+        trj = md.load(trj_file, top=topology, atom_indices=atom_indices, stride=stride)
+    else:
+        with md.open(trj_file) as f:
+            # the frames before start are skipped by the frame offsets
+            f.seek(start)
+            trj = f.read_as_traj(topology, stride=stride, atom_indices=atom_indices)
+    return trj, indices
+
+
+def iterload_selections(
+    trj_file: str,
+    top: str,
+    selections: List[str],
+    chunk: int,
+    cache_dir: str = None,
+    start: int = 0,
+    stride: int = 1,
+) -> Iterator[Tuple[object, List[np.ndarray]]]:
+    """
+    load_selections in chunks of at most chunk frames,
+    so that the memory does not grow with the length of the trajectory
+    """
+    import mdtraj as md
+
+    topology = load_topology(top, cache_dir)
+    atom_indices, indices = selected_atoms(top, selections, cache_dir)
+    # md.iterload does not stop when both skip and stride are given,
+    # so each chunk is sought and read with the number of frames left
+    with md.open(trj_file) as f:
+        n_frames = len(f)
+        for first in range(start, n_frames, chunk * stride):
+            f.seek(first)
+            trj = f.read_as_traj(
+                topology,
+                n_frames=min(chunk, len(range(first, n_frames, stride))),
+                stride=stride,
+                atom_indices=atom_indices,
+            )
+            yield trj, indices
+
+
+def read_index(index_file: str) -> List[Tuple[str, np.ndarray]]:
+    """
+    groups of a gromacs index file as (name, 0-based atom indices)
+    """
+    groups: List[Tuple[str, List[int]]] = []
+    with open(index_file, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                groups.append((line.strip("[] "), []))
+            elif line != "" and len(groups) > 0:
+                groups[-1][1].extend(int(atom) - 1 for atom in line.split())
+    return [(name, np.array(atoms, dtype=np.int64)) for name, atoms in groups]
+
+
+def index_group(
+    groups: List[Tuple[str, np.ndarray]], group: str
+) -> Tuple[str, np.ndarray]:
+    """
+    group given by its number or name (case-insensitive) as gromacs does
+    """
+    if group.isdigit() and int(group) < len(groups):
+        return groups[int(group)]
+    for name, atoms in groups:
+        if name.lower() == group.lower():
+            return name, atoms
+    LOGGER.error(f"group '{group}' is not found in the index file")
+    exit(1)
+
+
+def index_subset(
+    index_file: str, selections: List[str], union: str, cache_dir: str
+) -> Tuple[str, str, List[str]]:
+    """
+    index files for a trajectory holding only the atoms of the selections
+    (index groups), written once to cache_dir
+
+    @return
+    full:str index_file with the union of the selections appended as union
+    subset:str the selections renumbered by their position in that trajectory
+    names:List[str] names of the selections in both index files
+    """
+    name = hashlib.sha1("\n".join([union, *selections]).encode()).hexdigest()[:16]
+    key = f"{file_key(index_file)}_{name}"
+    full = Path(f"{cache_dir}/index_{key}.ndx")
+    subset = Path(f"{cache_dir}/index_{key}_subset.ndx")
+    groups = read_index(index_file)
+    selected = [index_group(groups, selection) for selection in selections]
+    if not (full.exists() and subset.exists()):
+        atom_indices = np.unique(np.concatenate([atoms for _, atoms in selected]))
+
+        def write_group(f, group: str, atoms: np.ndarray) -> None:
+            f.write(f"[ {group} ]\n".encode())
+            for i in range(0, len(atoms), 15):
+                f.write(
+                    (" ".join(str(a + 1) for a in atoms[i : i + 15]) + "\n").encode()
+                )
+
+        def write_full(f) -> None:
+            f.write(Path(index_file).read_bytes().rstrip(b"\n") + b"\n")
+            write_group(f, union, atom_indices)
+
+        def write_subset(f) -> None:
+            for group, atoms in selected:
+                write_group(f, group, np.searchsorted(atom_indices, atoms))
+
+        store(full, write_full)
+        store(subset, write_subset)
+    return str(full), str(subset), [group for group, _ in selected]
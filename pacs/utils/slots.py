@@ -0,0 +1,70 @@
+import multiprocessing as mp
+import os
+from multiprocessing.connection import wait
+
+
+class SlotPool:
+    """
+    pool of slots shared by the trials running in one pacs mdrun
+
+    A slot is a byte in a pipe, so that it can be taken from any forked trial
+    process and waited on together with the sentinels of running replicas.
+    pacs mdrun makes a pool for the MD of the replicas and another one for the
+    analysis and export workers, since an MD waiting for slots must not wait
+    for the analysis workers of its own trial.
+
+    @param
+    n_slot:int number of replicas (or workers) running at the same time
+        over all trials
+    """
+
+    def __init__(self, n_slot: int) -> None:
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.write(self.write_fd, b"\0" * n_slot)
+        # taking several slots at once must not interleave with other trials
+        self.lock = mp.Lock()
+        # number of slots held by this process
+        self.held = 0
+
+    def fileno(self) -> int:
+        return self.read_fd
+
+    def acquire(self, block: bool = True) -> bool:
+        """
+        take a slot. while acquire_many is taking several slots, the freed slots
+        are left to it, so that an MPI group is not starved by single replicas
+        """
+        if not self.lock.acquire(block=block):
+            return False
+        try:
+            return self.take(block)
+        finally:
+            self.lock.release()
+
+    def take(self, block: bool) -> bool:
+        while True:
+            try:
+                os.read(self.read_fd, 1)
+                self.held += 1
+                return True
+            except BlockingIOError:
+                if not block:
+                    return False
+                wait([self.read_fd])
+
+    def acquire_many(self, n: int) -> None:
+        with self.lock:
+            for _ in range(n):
+                self.take(block=True)
+
+    def release(self, n: int = 1) -> None:
+        self.held -= n
+        os.write(self.write_fd, b"\0" * n)
+
+    def release_held(self) -> None:
+        """
+        give back the slots of a trial which stopped while running replicas
+        """
+        if self.held > 0:
+            self.release(self.held)
@@ -0,0 +1,273 @@
+"""
+state of a trial stored in trialNNN/state.db (SQLite)
+
+each finished step of a cycle is recorded in the progress table as a row
+keyed on (cycle, stage, replica), so that a restarted run knows what to skip
+with a single indexed query instead of reading the progress.log of every cycle.
+
+stage
+    md: MD of a replica
+    analyze: CV calculation and ranking of the cycle (replica = 0)
+    export: export of the input structures of the next cycle (replica = 0)
+    rmmol: reduction of the trajectories (replica = 0)
+    rmfile: removal of the unnecessary files (replica = 0)
+
+the trajectories table is the manifest of the trial. it lists the trajectory
+files of each replica with their number of frames and size, so that the
+utilities (rmmol, rmfile, fit, genrepresent, gencom, genfeature) know the
+layout of a trial without probing its directories.
+"""
+
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+import pacs.utils.cvstore as cvstore
+from pacs.models.settings import MDsettings
+from pacs.utils.logger import generate_logger
+
+LOGGER = generate_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    cycle INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    replica INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL NOT NULL,
+    PRIMARY KEY (cycle, stage, replica)
+);
+CREATE TABLE IF NOT EXISTS trajectories (
+    cycle INTEGER NOT NULL,
+    replica INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    n_frames INTEGER,
+    size INTEGER,
+    PRIMARY KEY (cycle, replica, name)
+);
+"""
+
+# a connection must not be used across fork, so it is kept per process
+_CONNECTIONS: Dict[Tuple[int, str], sqlite3.Connection] = {}
+
+
+def connect(settings: MDsettings) -> sqlite3.Connection:
+    path = f"{settings.each_trial()}/state.db"
+    key = (os.getpid(), path)
+    if key in _CONNECTIONS:
+        return _CONNECTIONS[key]
+
+    Path(settings.each_trial()).mkdir(parents=True, exist_ok=True)
+    try:
+        # the trial and its background export write to the same file
+        conn = sqlite3.connect(path, timeout=600)
+        with conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'progress'"
+            ).fetchone()
+            for statement in SCHEMA.split(";"):
+                if statement.strip() != "":
+                    conn.execute(statement)
+            if exists is None:
+                import_progress_logs(settings, conn)
+    except sqlite3.Error as e:
+        LOGGER.error(f"error occurred at opening {path}: {e}")
+        exit(1)
+    _CONNECTIONS[key] = conn
+    return conn
+
+
+def record(
+    settings: MDsettings,
+    cycle: int,
+    stage: str,
+    replica: int = 0,
+    started: float = None,
+) -> None:
+    conn = connect(settings)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?)",
+            (cycle, stage, replica, started, time.time()),
+        )
+
+
+def is_recorded(settings: MDsettings, cycle: int, stage: str) -> bool:
+    row = (
+        connect(settings)
+        .execute(
+            "SELECT 1 FROM progress WHERE cycle = ? AND stage = ? AND replica = 0",
+            (cycle, stage),
+        )
+        .fetchone()
+    )
+    return row is not None
+
+
+def finished_replicas(settings: MDsettings, cycle: int) -> Set[int]:
+    rows = connect(settings).execute(
+        "SELECT replica FROM progress WHERE cycle = ? AND stage = 'md'", (cycle,)
+    )
+    return {replica for (replica,) in rows}
+
+
+def record_trajectory(
+    settings: MDsettings,
+    cycle: int,
+    replica: int,
+    name: str,
+    n_frames: int = None,
+) -> None:
+    """
+    add the trajectory file name of a replica to the manifest with its size.
+    a file which does not exist is removed from the manifest
+    """
+    path = Path(f"{settings.each_replica(_cycle=cycle, _replica=replica)}/{name}")
+    conn = connect(settings)
+    with conn:
+        if not path.exists():
+            conn.execute(
+                "DELETE FROM trajectories WHERE cycle = ? AND replica = ? AND name = ?",
+                (cycle, replica, name),
+            )
+            return
+        size = path.stat().st_size
+        updated = conn.execute(
+            "UPDATE trajectories SET size = ?, n_frames = COALESCE(?, n_frames) "
+            "WHERE cycle = ? AND replica = ? AND name = ?",
+            (size, n_frames, cycle, replica, name),
+        )
+        if updated.rowcount == 0:
+            conn.execute(
+                "INSERT INTO trajectories VALUES (?, ?, ?, ?, ?)",
+                (cycle, replica, name, n_frames, size),
+            )
+
+
+def record_n_frames(
+    settings: MDsettings, cycle: int, name: str, n_frames: Dict[int, int]
+) -> None:
+    """
+    set the number of frames of the trajectories of a cycle ({replica: n_frames})
+    """
+    conn = connect(settings)
+    with conn:
+        conn.executemany(
+            "UPDATE trajectories SET n_frames = ? "
+            "WHERE cycle = ? AND replica = ? AND name = ?",
+            [(n, cycle, replica, name) for replica, n in n_frames.items()],
+        )
+
+
+def replicas_by_cycle(settings: MDsettings) -> Dict[int, List[int]]:
+    """
+    {cycle: [replica, ...]} of the replicas whose MD has finished
+    """
+    rows = connect(settings).execute(
+        "SELECT cycle, replica FROM progress WHERE stage = 'md' "
+        "ORDER BY cycle, replica"
+    )
+    layout: Dict[int, List[int]] = {}
+    for cycle, replica in rows:
+        layout.setdefault(cycle, []).append(replica)
+    if len(layout) == 0:
+        LOGGER.error(f"no finished replica is recorded in {settings.each_trial()}")
+        LOGGER.error(
+            f"run 'pacs manifest -t {settings.trial}' if the trial was made by "
+            "an older version"
+        )
+        exit(1)
+    return layout
+
+
+def last_analyzed_cycle(settings: MDsettings) -> int:
+    """
+    the last cycle whose cv_ranked.npy has been written (-1 if none)
+    """
+    (cycle,) = (
+        connect(settings)
+        .execute("SELECT MAX(cycle) FROM progress WHERE stage = 'analyze'")
+        .fetchone()
+    )
+    return -1 if cycle is None else cycle
+
+
+def rebuild(settings: MDsettings) -> None:
+    """
+    rebuild the manifest of a trial by scanning its directories once.
+    the progress recorded in progress.log files by older versions is imported,
+    the replicas of the analyzed cycles are regarded as finished,
+    and the number of frames of prd{ext} is read from cv.npy (or cv.log)
+    """
+    ext = settings.trajectory_extension
+    conn = connect(settings)
+    with conn:
+        import_progress_logs(settings, conn)
+        # all replicas of a cycle whose cv_ranked.npy exists have finished
+        for cycle in range(1000):
+            cycle_dir = Path(settings.each_cycle(_cycle=cycle))
+            if not cycle_dir.exists():
+                break
+            if not cvstore.exists(settings, cycle, "cv_ranked"):
+                continue
+            ranked = cvstore.cv_file(settings, cycle, "cv_ranked")
+            if not ranked.exists():
+                ranked = cvstore.cv_file(settings, cycle, "cv_ranked", ".log")
+            finished = ranked.stat().st_mtime
+            rows = [(cycle, "analyze", 0, None, finished)]
+            if cycle > 0:
+                # the previous cycle has been exported to this cycle
+                rows.append((cycle - 1, "export", 0, None, finished))
+            for replica in range(1, 1000):
+                if not (cycle_dir / f"replica{replica:03}").exists():
+                    break
+                rows.append((cycle, "md", replica, None, finished))
+            conn.executemany(
+                "INSERT OR IGNORE INTO progress VALUES (?, ?, ?, ?, ?)", rows
+            )
+    layout = replicas_by_cycle(settings)
+    for cycle, replicas in layout.items():
+        n_frames = cvstore.read_n_frames(settings, cycle)
+        for replica in replicas:
+            record_trajectory(settings, cycle, replica, f"prd{ext}")
+            record_trajectory(settings, cycle, replica, f"prd_rmmol{ext}")
+        record_n_frames(settings, cycle, f"prd{ext}", n_frames)
+        record_n_frames(settings, cycle, f"prd_rmmol{ext}", n_frames)
+    LOGGER.info(f"manifest of {settings.each_trial()} was rebuilt")
+
+
+def import_progress_logs(settings: MDsettings, conn: sqlite3.Connection) -> None:
+    """
+    record the steps written in the progress.log files of a trial
+    started by an older version, so that it can be resumed
+    """
+    n_imported = 0
+    for cycle in range(1000):
+        log = Path(f"{settings.each_cycle(_cycle=cycle)}/summary/progress.log")
+        if not log.exists():
+            if not log.parent.exists():
+                break
+            continue
+        finished = log.stat().st_mtime
+        rows = []
+        if (log.parent / "cv_ranked.log").exists():
+            rows.append((cycle, "analyze", 0, None, finished))
+        with open(log, "r") as f:
+            for line in f:
+                if "export to" in line:
+                    rows.append((cycle, "export", 0, None, finished))
+                elif "reduced" in line:
+                    rows.append((cycle, "rmmol", 0, None, finished))
+                elif "rmfile" in line:
+                    rows.append((cycle, "rmfile", 0, None, finished))
+                elif "replica" in line:
+                    replica = int(re.findall(r"\d+", line)[-1])
+                    rows.append((cycle, "md", replica, None, finished))
+        # keep the rows recorded by this version
+        conn.executemany("INSERT OR IGNORE INTO progress VALUES (?, ?, ?, ?, ?)", rows)
+        n_imported += 1
+    if n_imported > 0:
+        LOGGER.info(f"progress.log files in {settings.each_trial()} were imported")
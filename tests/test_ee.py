@@ -0,0 +1,70 @@
+import mdtraj as md
+import numpy as np
+import pytest
+from pacs.mdrun.analyzer.ee import EdgeExpansion
+from pacs.models.settings import MDsettings
+
+N_RESIDUES = 20
+
+
+def write_trajectory(path, top, n_frames, seed):
+    rng = np.random.default_rng(seed)
+    xyz = rng.random((n_frames, top.n_atoms, 3), dtype=np.float32) * 2
+    md.Trajectory(xyz, top).save(str(path))
+
+
+@pytest.fixture
+def settings(tmp_path):
+    top = md.Topology()
+    chain = top.add_chain()
+    for _ in range(N_RESIDUES):
+        top.add_atom("CA", md.element.carbon, top.add_residue("ALA", chain))
+    settings = MDsettings(
+        working_dir=str(tmp_path),
+        trial=1,
+        analyzer="mdtraj",
+        trajectory_extension=".xtc",
+        top_mdtraj=str(tmp_path / "top.pdb"),
+        # selection1 (fit) is not a leading part of selection2
+        selection1="resid 10 to 19 and name CA",
+        selection2="name CA",
+        selection3="resid 10 to 19 and name CA",
+        selection4="name CA",
+    )
+    md.Trajectory(np.zeros((1, N_RESIDUES, 3), dtype=np.float32), top).save(
+        settings.top_mdtraj
+    )
+    for cycle, seed in [(0, 0), (1, 1)]:
+        dir = tmp_path / f"trial001/cycle{cycle:03}/replica001"
+        dir.mkdir(parents=True)
+        write_trajectory(dir / "prd.xtc", top, 12, seed)
+    return settings
+
+
+def test_cal_by_mdtraj_fit_selection_is_not_prefix(settings):
+    analyzer = EdgeExpansion()
+    pcs = analyzer.cal_by_mdtraj(settings, 1, 1)
+
+    model = analyzer.load_pca(settings)
+    ref = md.load(
+        f"{settings.each_replica(_cycle=0, _replica=1)}/prd.xtc",
+        top=settings.top_mdtraj,
+    )
+    fit_index = ref.top.select(settings.selection3)
+    np.testing.assert_allclose(model["reference"], ref.xyz[0, fit_index], atol=1e-6)
+
+    trj = md.load(
+        f"{settings.each_replica(_cycle=1, _replica=1)}/prd.xtc",
+        top=settings.top_mdtraj,
+    )
+    trj.superpose(ref, 0, atom_indices=fit_index, ref_atom_indices=fit_index)
+    xyz = trj.xyz.reshape(len(trj), -1)
+    expected = (xyz - model["mean"]) @ model["components"].T
+    assert pcs.shape == (12, 4)
+    np.testing.assert_allclose(pcs, expected, atol=1e-4)
+
+
+def test_cal_by_mdtraj_fit_selection_mismatch(settings):
+    settings.selection1 = "resid 10 to 18 and name CA"
+    with pytest.raises(SystemExit):
+        EdgeExpansion().cal_by_mdtraj(settings, 1, 1)
@@ -0,0 +1,32 @@
+import multiprocessing as mp
+import time
+
+from pacs.utils.slots import SlotPool
+
+
+def take_single_slots(slots: SlotPool, seconds: float) -> None:
+    # a rolling window taking a slot whenever one is free
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if slots.acquire(block=False):
+            time.sleep(0.05)
+            slots.release()
+
+
+def test_acquire_many_is_not_starved_by_single_slots():
+    slots = SlotPool(2)
+    workers = [
+        mp.Process(target=take_single_slots, args=(slots, 1.5)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.2)
+    started = time.monotonic()
+    slots.acquire_many(2)
+    waited = time.monotonic() - started
+    slots.release(2)
+    for worker in workers:
+        worker.join()
+    # the freed slots are left to acquire_many, so it waits for about one hold
+    assert waited < 0.3
+    assert slots.held == 0
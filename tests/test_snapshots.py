@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from pacs.models.settings import Snapshots
+
+
+def snapshots(cv):
+    cv = np.asarray(cv, dtype=np.float32)
+    return Snapshots.from_arrays(np.ones(len(cv)), np.arange(len(cv)), cv)
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_top_matches_sorted(reverse):
+    cv = np.random.default_rng(0).integers(0, 20, 100)
+    top = snapshots(cv).top(10, reverse=reverse)
+    key = -cv if reverse else cv
+    expected = sorted(range(len(cv)), key=lambda i: key[i])
+    assert top.frame.tolist() == expected[:10]
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_top_ranks_nan_last(reverse):
+    cv = [3.0, np.nan, 1.0, np.nan, 2.0]
+    top = snapshots(cv).top(4, reverse=reverse)
+    assert len(top) == 4
+    if reverse:
+        assert top.frame.tolist() == [0, 4, 2, 1]
+    else:
+        assert top.frame.tolist() == [2, 4, 0, 1]
+
+
+def test_top_all_nan():
+    top = snapshots([np.nan] * 3).top(2)
+    assert top.frame.tolist() == [0, 1]